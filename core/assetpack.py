@@ -0,0 +1,148 @@
+"""Single file asset packs. Images are stored as raw 32 bit pixels with their
+parsed metadata, so they can be made into surfaces straight from a memory map
+instead of being decoded. Other files are stored as they are. Images may also
+be frames of a shared atlas page, so a whole folder is one surface at runtime.
+
+Layout: header (magic,version,index offset), member data, marshalled (index,pages).
+The index is marshalled rather than pickled as packs come with downloaded
+games, and loading a pickle can run code."""
+import os,mmap,struct,marshal,cStringIO,threading
+
+magic = "PWPK"
+version = 3
+ext = ".pwpack"
+header = struct.Struct("<4sIQ")
+
+class PackError(Exception):
+    pass
+
+class PackWriter:
+    def __init__(self,path):
+        self.path = path
+        self.f = open(path,"wb")
+        self.f.write(header.pack(magic,version,0))
+        self.index = {}
+        self.pages = {}
+    def write(self,data):
+        offset = self.f.tell()
+        self.f.write(data)
+        self.f.write("\0"*(-len(data)%8))
+        return offset,len(data)
+    def add_file(self,name,data):
+        offset,size = self.write(data)
+        self.index[name] = {"offset":offset,"size":size}
+    def add_pixels(self,name,data,size,format,meta=None):
+        """data is size[0]*size[1] pixels in format RGBA or RGBX"""
+        offset,length = self.write(data)
+        self.index[name] = {"offset":offset,"size":length,"width":size[0],"height":size[1],
+            "format":format,"meta":meta}
+    def add_page(self,name,data,size,format):
+        """Atlas page, which is not a member itself but holds the pixels of frames"""
+        offset,length = self.write(data)
+        self.pages[name] = {"offset":offset,"size":length,"width":size[0],"height":size[1],"format":format}
+    def add_frame(self,name,page,rect,meta=None):
+        """Image member which is the area rect=[x,y,w,h] of an atlas page"""
+        p = self.pages[page]
+        self.index[name] = {"page":page,"rect":list(rect),"width":rect[2],"height":rect[3],
+            "page_size":(p["width"],p["height"]),"format":p["format"],"meta":meta}
+    def close(self):
+        offset = self.f.tell()
+        marshal.dump((self.index,self.pages),self.f)
+        self.f.seek(0)
+        self.f.write(header.pack(magic,version,offset))
+        self.f.close()
+
+class Pack:
+    def __init__(self,path):
+        self.path = path
+        f = open(path,"rb")
+        try:
+            self.map = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        mg,ver,offset = header.unpack(self.map[:header.size])
+        if mg!=magic or ver!=version:
+            self.map.close()
+            raise PackError("Not a version %s asset pack: %s"%(version,path))
+        try:
+            self.index,self.pages = marshal.loads(self.map[offset:])
+            if not isinstance(self.index,dict) or not isinstance(self.pages,dict):
+                raise ValueError
+        except (ValueError,EOFError,TypeError):
+            self.map.close()
+            raise PackError("Corrupt asset pack index: %s"%path)
+        self.stamp = stamp(path)
+    def namelist(self):
+        return self.index.keys()
+    def record(self,name):
+        return self.index.get(name,None)
+    def data(self,name):
+        """Buffer over the member's bytes in the memory map, without copying.
+        For an atlas frame this is the whole page."""
+        r = self.index[name]
+        if "page" in r:
+            r = self.pages[r["page"]]
+        return buffer(self.map,r["offset"],r["size"])
+    def open(self,name):
+        """File of the member's bytes. For an atlas frame these are its own
+        pixels, cut out of the page row by row."""
+        if name not in self.index:
+            raise IOError("No member %s in %s"%(name,self.path))
+        r = self.index[name]
+        if "page" in r:
+            p = self.pages[r["page"]]
+            x,y,w,h = r["rect"]
+            stride = p["width"]*4
+            start = p["offset"]+y*stride+x*4
+            return cStringIO.StringIO("".join([self.map[start+i*stride:start+i*stride+w*4] for i in range(h)]))
+        return cStringIO.StringIO(self.map[r["offset"]:r["offset"]+r["size"]])
+    def close(self):
+        self.map.close()
+
+def shelf_pack(sizes,page_size=(1024,1024)):
+    """Place rectangles of the given sizes on as few pages as fit, in rows.
+    Returns [page number,x,y] for each size, in the same order."""
+    places = [None]*len(sizes)
+    page = x = y = row = 0
+    for i in sorted(range(len(sizes)),key=lambda i:-sizes[i][1]):
+        w,h = sizes[i]
+        if x and x+w>page_size[0]:
+            x,y,row = 0,y+row,0
+        if y and y+h>page_size[1]:
+            page,x,y,row = page+1,0,0,0
+        places[i] = [page,x,y]
+        x += w
+        row = max(row,h)
+    return places
+
+def stamp(path):
+    st = os.stat(path)
+    return (st.st_size,st.st_mtime)
+
+def is_pack(path):
+    """True for a pack this version can read, older packs are left as plain files"""
+    if not path.endswith(ext) or not os.path.isfile(path):
+        return False
+    f = open(path,"rb")
+    try:
+        h = f.read(header.size)
+    finally:
+        f.close()
+    return len(h)==header.size and header.unpack(h)[:2]==(magic,version)
+
+open_packs = {}
+open_lock = threading.Lock()  #The registry opens packs from its index threads
+def get(path):
+    """Open pack at path, reusing the mapping until the file changes"""
+    with open_lock:
+        pack = open_packs.get(path,None)
+        if pack and pack.stamp==stamp(path):
+            return pack
+        if pack:
+            pack.close()
+        pack = open_packs[path] = Pack(path)
+        return pack
+def close_all():
+    with open_lock:
+        for path in open_packs.keys():
+            open_packs.pop(path).close()
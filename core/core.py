@@ -3,15 +3,22 @@ import sys
 sys.path.append("core/include")
 sys.path.append("include")
 import time
+import math
 import gui
 import os
 import pygame
 pygame.font.init()
 import random
 import pickle
+import copy
 import re
 import textutil
 import registry
+import assetpack
+import lru
+import prefetch
+import macroexpand
+import dirtyrects
 import zipfile
 import simplejson as json
 ImgFont = textutil.ImgFont
@@ -151,10 +158,20 @@ class meta:
         return self
         
 class layer(dict):
+    """Layer:[class names] from sorting.txt. index looks a class name up in a
+    table built from the layers once, which is built again if a layer is set."""
+    table = None
+    def __setitem__(self,i,names):
+        dict.__setitem__(self,i,names)
+        self.table = None
     def index(self,ob):
-        for i in self.keys():
-            if ob in self[i]:
-                return i
+        if self.table is None:
+            table = {}
+            for i in self.keys():
+                for name in self[i]:
+                    table.setdefault(name,i)
+            self.table = table
+        return self.table.get(ob,None)
 zlayers = layer()
 zi = 0
 ulayers = layer()
@@ -178,41 +195,93 @@ for line in sort.readlines():
         elif sortmode == "pri":
             ulayers[level]=x
         
+def get_layer(variables,key):
+    return str(zlayers.index(key[7:]))
+def get_version(variables,key):
+    return __version__
+def get_num_screens(variables,key):
+    return str(assets.num_screens)
+def set_speaking(variables,key,value):
+    dict.__setitem__(variables,key,value)
+    try:
+        variables["_speaking_name"] = assets.gportrait().nametag.split("\n")
+    except:
+        pass
+def set_music_fade(variables,key,value):
+    dict.__setitem__(variables,key,value)
+    assets.smus(assets.gmus())
+
 class Variables(dict):
-    def __getitem__(self,key):
-        return self.get(key)
+    """Names in getters are computed when read and names in setters do
+    something when written, any other name is just a dict entry"""
+    getters = {"_version":get_version,"_num_screens":get_num_screens}  #name:function(variables,name)
+    setters = {"_speaking":set_speaking,"_music_fade":set_music_fade}  #name:function(variables,name,value)
+    counts = [0,0,0]  #reads,writes,special names read or written, since take_counts
+    def __init__(self,*args,**kwargs):
+        dict.__init__(self,*args,**kwargs)
+        self.typed_values = {}  #(name,convert):(string value,converted value)
     def get(self,key,*args):
-        if key.startswith("_layer_"):
-            layer = zlayers.index(key[7:])
-            if layer is not None:
-                return str(layer)
-        if key=="_version":
-            return __version__
-        if key=="_num_screens":
-            return str(assets.num_screens)
+        self.counts[0] += 1
+        getter = self.getters.get(key,None)
+        if getter:
+            self.counts[2] += 1
+            return getter(self,key)
         return dict.get(self,key,*args)
-    def __setitem__(self,key,value,*args):
-        if key=="_speaking":
-            dict.__setitem__(self,key,value,*args)
-            try:
-                self["_speaking_name"] = assets.gportrait().nametag.split("\n")
-            except:
-                pass
-        if key=="_music_fade":
-            dict.__setitem__(self,key,value,*args)
-            assets.smus(assets.gmus())
-            return
-        return dict.__setitem__(self,key,value,*args)
+    __getitem__ = get
+    def __setitem__(self,key,value):
+        self.counts[1] += 1
+        setter = self.setters.get(key,None)
+        if setter:
+            self.counts[2] += 1
+            return setter(self,key,value)
+        return dict.__setitem__(self,key,value)
+    def typed(self,key,convert,default=None):
+        """convert(self.get(key,default)), remembered until a different value is stored"""
+        value = self.get(key,default)
+        entry = self.typed_values.get((key,convert),None)
+        if entry and entry[0] is value:
+            return entry[1]
+        converted = convert(value)
+        self.typed_values[(key,convert)] = (value,converted)
+        return converted
+    def vint(self,key,default=None):
+        return self.typed(key,int,default)
+    def vfloat(self,key,default=None):
+        return self.typed(key,float,default)
+    def vbool(self,key,default="false"):
+        return self.typed(key,vtrue,default)
+    def vset(self,key,value):
+        """Store value as a string, which scripts and saves see, keeping value
+        as its typed view"""
+        text = str(value)
+        self[key] = text
+        self.typed_values[(key,type(value))] = (text,value)
+    @classmethod
+    def take_counts(cls):
+        """[reads,writes,special] since the last call, which starts counting again"""
+        counts = cls.counts[:]
+        cls.counts[:] = [0,0,0]
+        return counts
+Variables.getters.update(("_layer_"+name,get_layer) for names in zlayers.values() for name in names)
 
 assert Variables().get("_version",None)
         
 class ImgFrames(list):
     pass
 
+def frames_size(img):
+    """Bytes of an art_cache entry, ImgFrames or an atlas page"""
+    if isinstance(img,pygame.Surface):
+        return img.get_width()*img.get_height()*img.get_bytesize()
+    return img.nbytes
+
 class Assets(object):
     lists = {}
     snds = {}
-    art_cache = {}
+    art_cache = lru.LRUCache(32*1024*1024,frames_size)  #Decoded art shared by all scripts
+    meta_cache = {}  #Parsed art .txt files, path:[stamp,meta]
+    preparse_meta = 0
+    prefetcher = prefetch.Prefetcher()  #Loads art and sounds for upcoming script lines
     variables = Variables()
     gbamode = False
     num_screens = 2
@@ -233,6 +302,7 @@ class Assets(object):
     registry = registry.Registry(".")
     def init(self):
         self.registry = registry.Registry(".")
+        self.prefetcher = prefetch.Prefetcher(self.prefetch_path,self.prefetch_load)
     def get_stack(self):
         stack = []
         for s in self.stack:
@@ -259,6 +329,11 @@ class Assets(object):
     def gmus(self):
         return self._music_vol
     music_volume = property(gmus,smus)
+    def _g_art_cache_mb(self):
+        return self.art_cache.budget//(1024*1024)
+    def _s_art_cache_mb(self,v):
+        self.art_cache.set_budget(int(v)*1024*1024)
+    art_cache_mb = property(_g_art_cache_mb,_s_art_cache_mb)
     def _appendgba(self):
         if not self.gbamode: return ""
         return "_gba"
@@ -282,54 +357,47 @@ class Assets(object):
         return text.split("\n")
     def parse_macros(self,lines):
         """Alters lines to not include macro definitions, and returns macros"""
-        macros = {}
-        mode = "normal"
-        i = 0
-        while i<len(lines):
-            line = lines[i]
-            if line.startswith("macro "):
-                del lines[i]
-                i -= 1
-                mode = "macro"
-                macroname = line[6:].strip()
-                macrolines = []
-            elif mode == "macro":
-                del lines[i]
-                i -= 1
-                if line=="endmacro":
-                    mode = "normal"
-                    macros[macroname] = macrolines
-                else:
-                    macrolines.append(line)
-            i+=1
-        return macros
+        return macroexpand.parse_macros(lines)
     def replace_macros(self,lines,macros):
         """Applies macros to lines"""
-        i = 0
-        while i<len(lines):
-            line = lines[i]
-            if line.startswith("{"):
-                del lines[i]
-                i -= 1
-                args = line[1:-1].split(" ")
-                if macros.get(args[0],None):
-                    newlines = "\n".join(macros[args[0]])
-                    args = args[1:]
-                    kwargs = {}
-                    for a in args[:]:
-                        if a.count("=")==1:
-                            args.remove(a)
-                            k,v = a.split("=",1)
-                            kwargs[k] = v
-                    newlines = newlines.replace("$0",str(i))
-                    for i2 in range(len(args)):
-                        newlines = newlines.replace("$%s"%(i2+1),args[i2])
-                    for k in kwargs:
-                        newlines = newlines.replace("$%s"%k,kwargs[k])
-                    newlines = newlines.split("\n")
-                    for l in reversed(newlines):
-                        lines.insert(i+1,l)
-            i += 1
+        lines[:] = macroexpand.expand(lines,macros)
+    macro_files = {}  #Parsed macro files, path:[mtime,macros]
+    macro_libraries = {}  #Merged macros for each case, case:[watched paths,mtimes,macros]
+    def macro_file(self,path):
+        """Macros defined in the file at path, only parsed again when it changes"""
+        mtime = os.path.getmtime(path)
+        entry = self.macro_files.get(path,None)
+        if entry and entry[0]==mtime:
+            return entry[1]
+        macros = self.parse_macros(self.raw_lines(path,"","",True))
+        self.macro_files[path] = [mtime,macros]
+        return macros
+    def macro_library(self):
+        """Macros from core/macros, then the game folder, then the case folder,
+        merged into one table. It is rebuilt when a file or folder changes."""
+        self.game = self.game.replace("\\","/")
+        case = self.game
+        game = self.game.rsplit("/",1)[0]
+        entry = self.macro_libraries.get(case,None)
+        if entry:
+            try:
+                if [os.path.getmtime(p) for p in entry[0]]==entry[1]:
+                    return entry[2]
+            except OSError:
+                pass
+        folders = ["core/macros",game,case]
+        mtimes = [os.path.getmtime(p) for p in folders]
+        paths = ["core/macros/"+f for f in os.listdir("core/macros") if f.endswith(".mcro")]
+        for pth in [game,case]:
+            if os.path.exists(pth+"/macros.txt"):
+                paths.append(pth+"/macros.txt")
+            paths.extend([pth+"/"+f for f in os.listdir(pth) if f.endswith(".mcro")])
+        macros = {}
+        for p in paths:
+            mtimes.append(os.path.getmtime(p))
+            macros.update(self.macro_file(p))
+        self.macro_libraries[case] = [folders+paths,mtimes,macros]
+        return macros
     def open_script(self,name,macros=True,ext=".txt"):
         lines = self.raw_lines(name,ext,use_unicode=True)
         reallines = []
@@ -349,21 +417,7 @@ class Assets(object):
             else:
                 reallines.append(line)
         lines = reallines
-        the_macros = {}
-        for f in os.listdir("core/macros"):
-            if f.endswith(".mcro"):
-                mlines = self.raw_lines("core/macros/"+f,"","",True)
-                parse = self.parse_macros(mlines)
-                the_macros.update(parse)
-        self.game = self.game.replace("\\","/")
-        case = self.game
-        game = self.game.rsplit("/",1)[0]
-        for pth in [game,case]:
-            if os.path.exists(pth+"/macros.txt"):
-                the_macros.update(self.parse_macros(self.raw_lines("macros.txt","",start=pth,use_unicode=True)))
-            for f in os.listdir(pth):
-                if f.endswith(".mcro"):
-                    the_macros.update(self.parse_macros(self.raw_lines(f,"",start=pth,use_unicode=True)))
+        the_macros = dict(self.macro_library())
         if macros:
             the_macros.update(self.parse_macros(lines))
             self.replace_macros(lines,the_macros)
@@ -423,6 +477,9 @@ set _font_new_resume_size 14""".split("\n"):
     def Surface(self,size,flags=0):
         return pygame.Surface(size,flags)
     def search_locations(self,search_path,name):
+        path = self.registry_path(search_path,name)
+        if path:
+            return path
         self.game = self.game.replace("\\","/")
         case = self.game
         game = self.game.rsplit("/",1)[0]
@@ -435,6 +492,104 @@ set _font_new_resume_size 14""".split("\n"):
 
         if os.path.exists(search_path+"/"+name):
             return search_path+"/"+name
+    resolved_for = None
+    def check_registry(self):
+        """Forget remembered art and file resolutions if the registry has been replaced"""
+        if self.resolved_for is not self.registry:
+            self.art_resolved = {}
+            self.art_tries = {}
+            self.path_cache = {}
+            self.resolved_for = self.registry
+    def art_paths(self,name):
+        """Registry paths of an art file and of its .txt metadata"""
+        self.check_registry()
+        cache = self.art_resolved
+        if name in cache:
+            return cache[name]
+        pre = "art/"
+        textpath = self.registry.lookup(pre+name+".txt",True)
+        if not textpath:
+            textpath = self.registry.lookup(pre+name.rsplit(".",1)[0]+".txt",True)
+        artpath = self.registry.lookup((pre+name).replace(".zip/","/"))
+        cache[name] = artpath,textpath
+        return artpath,textpath
+    def load_meta(self,path):
+        """Parsed meta for the art .txt file at path, only read again if the file changed"""
+        st = registry.file_stamp(path)
+        entry = self.meta_cache.get(path,None)
+        if entry and entry[0]==st:
+            return entry[1]
+        m = meta().load_from(self.registry.open(path))
+        self.meta_cache[path] = [st,m]
+        return m
+    def parse_all_meta(self):
+        """Fill meta_cache with every art .txt file in the registry"""
+        for tag in self.registry.tags(True):
+            if tag.startswith("art/") and tag.endswith(".txt"):
+                try:
+                    self.load_meta(self.registry.lookup(tag,True))
+                except Exception:
+                    pass
+    def resolve_art(self,name):
+        """Names to try for art called name, those which exist in the registry.
+        An empty list means the art is absent."""
+        self.check_registry()
+        if name in self.art_tries:
+            return self.art_tries[name]
+        tries = [name]
+        for ext in ext_for(["image"]):
+            tries.append(name+ext)
+        found = self.art_tries[name] = [t for t in tries if self.art_paths(t)[0]]
+        return found
+    prefetch_keys = [None,[255,0,255]]  #Colorkeys art is usually opened with
+    def art_key(self,artpath,textpath,key=None):
+        """art_cache key for art opened with colorkey key"""
+        return (artpath,textpath,key and tuple(key))
+    def prefetch_path(self,kind,name):
+        """Path the prefetcher should load for a script asset, None if missing or already loaded.
+        Runs on the main thread when scripts are scanned, the prefetch thread only gets the path."""
+        if kind=="art":
+            artpath,textpath = self.art_paths(name)
+            if not artpath or self.registry.packed(artpath):
+                return
+            for key in self.prefetch_keys:
+                if self.art_key(artpath,textpath,key) in self.art_cache:
+                    return
+            return artpath
+        elif kind=="sound":
+            path = self.get_path(name,"sound","sfx")
+            if not self.snds.get(path,None) and not path.endswith(".mp3"):
+                return path
+        elif kind=="music":
+            return self.get_path(name,"music","music")
+    def prefetch_load(self,kind,path):
+        """Runs on the prefetch thread. Art is decoded but not converted,
+        music is only read through so it comes from the disk cache."""
+        if kind=="art":
+            return pygame.image.load(self.registry.open(path),path)
+        if kind=="sound" and self.sound_init==1:
+            return mixer.Sound(path)
+        if kind=="music" and os.path.exists(path):
+            f = open(path,"rb")
+            while f.read(65536): pass
+            f.close()
+            return path
+    def convert(self,texture):
+        if texture.get_flags()&pygame.SRCALPHA:
+            return texture.convert_alpha()
+        return texture.convert()
+    def packed_texture(self,artpath,record,data):
+        """Surface for an image from an asset pack. Atlas frames are subsurfaces
+        of their page, which is kept in art_cache so it is converted once and
+        counts against the same budget as the art."""
+        if "page" not in record:
+            return self.convert(pygame.image.frombuffer(data,(record["width"],record["height"]),record["format"]))
+        page_key = (artpath.split(assetpack.ext+"/",1)[0],record["page"])
+        page = self.art_cache.get(page_key)
+        if page is None:
+            page = self.convert(pygame.image.frombuffer(data,record["page_size"],record["format"]))
+            self.art_cache.put(page_key,page)
+        return page.subsurface(record["rect"])
     def _open_art_(self,name,key=None):
         """Returns list of frame images"""
         if self.cur_script and self.cur_script.imgcache.has_key(name):
@@ -443,27 +598,33 @@ set _font_new_resume_size 14""".split("\n"):
             self.real_path = img.real_path
             return img
         self.meta = meta()
-        pre = "art/"
-        textpath = self.registry.lookup(pre+name+".txt",True)
-        if not textpath:
-            textpath = self.registry.lookup(pre+name.rsplit(".",1)[0]+".txt",True)
-        print "lookup",pre+name
-        artpath = self.registry.lookup((pre+name).replace(".zip/","/"))
-        print pre+name+".txt",artpath,textpath
+        artpath,textpath = self.art_paths(name)
+        cache_key = self.art_key(artpath,textpath,key)
+        if artpath:
+            img = self.art_cache.get(cache_key)
+            if img is not None:
+                self.meta = img._meta
+                self.real_path = img.real_path
+                if self.cur_script:
+                    self.cur_script.imgcache[name] = img
+                return img
+        packed = artpath and self.registry.packed(artpath)
+        if packed and packed[0]["meta"] and not textpath:
+            self.meta.__dict__.update(copy.deepcopy(packed[0]["meta"]))
         if textpath:
             try:
-                f = self.registry.open(textpath)
-                self.meta.load_from(f)
+                self.meta = self.load_meta(textpath)
             except:
                 import traceback
                 traceback.print_exc()
-                raise art_error("Art textfile corrupt:"+pre+name[:-4]+".txt")
-        print self.registry.open(artpath)
-        texture = pygame.image.load(self.registry.open(artpath),artpath)
-        if texture.get_flags()&pygame.SRCALPHA:
-            texture = texture.convert_alpha()
+                raise art_error("Art textfile corrupt:art/"+name[:-4]+".txt")
+        texture = self.prefetcher.take(artpath)
+        if texture is None and packed:
+            texture = self.packed_texture(artpath,*packed)
         else:
-            texture = texture.convert()
+            if texture is None:
+                texture = pygame.image.load(self.registry.open(artpath),artpath)
+            texture = self.convert(texture)
         if key:
             texture.set_colorkey(key)
         img = []
@@ -481,6 +642,8 @@ set _font_new_resume_size 14""".split("\n"):
         img = ImgFrames(img)
         img._meta = self.meta
         img.real_path = self.real_path = artpath
+        img.nbytes = texture.get_width()*texture.get_height()*texture.get_bytesize()
+        self.art_cache.put(cache_key,img)
         if self.cur_script:
             self.cur_script.imgcache[name] = img
         return img
@@ -489,18 +652,12 @@ set _font_new_resume_size 14""".split("\n"):
         Will open gif, then png, then jpg.  Returns list of 
         frame images"""
         self.real_path = None
-        tries = [name]
-        for ext in ext_for(["image"]):
-            tries.append(name+ext)
-        for t in tries:
+        for t in self.resolve_art(name):
             try:
                 return self._open_art_(t,key)
             except (IOError,ImportError,pygame.error,TypeError):
-                print "there was a typeerror"
-                pass
-        import traceback
-        traceback.print_exc()
-        print "raising corrupt or missing art file"
+                import traceback
+                traceback.print_exc()
         raise art_error("Art file corrupt or missing:"+name)
     def init_sound(self,reset=False):
         self.sound_repeat_timer = {}
@@ -524,12 +681,34 @@ set _font_new_resume_size 14""".split("\n"):
                 self.sound_init = -1
         if self.sound_init==1: return True
         return False
+    def registry_path(self,pre,name):
+        """Path of pre/name if pre is a folder the registry indexes and the file
+        is a loose one (not in a zip or pack)"""
+        if pre not in registry.filepaths:
+            return
+        path = self.registry.lookup(pre+"/"+name,True)
+        if path and ".zip/" not in path and assetpack.ext+"/" not in path:
+            return path
     def get_path(self,track,type,pre=""):
+        """Find a sound, music or movie file in the case, game or PyWright folders,
+        remembering the answer until the registry is replaced"""
+        self.check_registry()
+        key = (track,type,pre)
+        if key not in self.path_cache:
+            self.path_cache[key] = self.find_path(track,type,pre)
+        return self.path_cache[key]
+    def find_path(self,track,type,pre=""):
         tries = [track]
         #Unknown extension, make sure to check all extension types
         if noext(track)==track:
             for ext in ext_for([type]):
                 tries.insert(0,track+ext)
+        if pre in registry.filepaths:
+            for t in tries:
+                path = self.registry_path(pre,t)
+                if path:
+                    return path
+            return "/"+pre+"/"+track
         #Get parent game folder, in case we are in a case folder
         game = self.game.replace("\\","/").rsplit("/",1)[0]
         if pre: pre = "/"+pre+"/"
@@ -546,6 +725,7 @@ set _font_new_resume_size 14""".split("\n"):
         p = self.get_path(track,"music",pre)
         if not p:
             return False
+        self.prefetcher.take(p)
         try:
             mixer.music.load(p)
             return True
@@ -577,15 +757,17 @@ set _font_new_resume_size 14""".split("\n"):
         if self.snds.get(path,None):
             snd = self.snds[path]
         else:
-            try:
-                if path.endswith(".mp3") and audiere:
-                    snd = aud.open_file(path)
-                else:
-                    snd = mixer.Sound(path)
-            except:
-                import traceback
-                traceback.print_exc()
-                return
+            snd = self.prefetcher.take(path)
+            if not snd:
+                try:
+                    if path.endswith(".mp3") and audiere:
+                        snd = aud.open_file(path)
+                    else:
+                        snd = mixer.Sound(path)
+                except:
+                    import traceback
+                    traceback.print_exc()
+                    return
             self.snds[path] = snd
         if not layer:
             snd.stop()
@@ -650,15 +832,12 @@ set _font_new_resume_size 14""".split("\n"):
         id_name = self.variables.get("_speaking","")
         if isinstance(id_name,portrait) or not id_name:
             return id_name
-        ports = []
-        for p in self.cur_script.obs:
-            if isinstance(p,portrait) and not getattr(p,"kill",0):
-                ports.append(p)
-                if getattr(p,"id_name",None)==id_name: return p
-        for p in self.cur_script.obs:
-            if isinstance(p,portrait) and not getattr(p,"kill",0):
-                ports.append(p)
-                if getattr(p,"charname",None)==id_name: return p
+        world = self.cur_script.world
+        ports = [p for p in world.in_render_order(world.instances(portrait)) if not getattr(p,"kill",0)]
+        for p in ports:
+            if getattr(p,"id_name",None)==id_name: return p
+        for p in ports:
+            if getattr(p,"charname",None)==id_name: return p
         if ports: return ports[0]
         return None
     portrait = property(gportrait)
@@ -666,7 +845,7 @@ set _font_new_resume_size 14""".split("\n"):
         if hide: stack = True
         assets = self
         self = self.cur_script
-        if not stack: [(lambda o:setattr(o,"kill",1))(o) for o in self.obs if isinstance(o,portrait)]
+        if not stack: [(lambda o:setattr(o,"kill",1))(o) for o in self.world.instances(portrait)]
         assets.variables["_speaking"] = None
         p = portrait(name,hide)
         p.pos[0] += assets.px
@@ -725,9 +904,11 @@ set _font_new_resume_size 14""".split("\n"):
         self.variables.update(v)
         if getattr(self,"_track",None):
             self.play_music(self._track,self._loop,reset_track=False)
-    def show_load(self):
+    def show_load(self,done=None,total=None):
         self.make_screen()
         txt = "LOADING " + random.choice(["/","\\","-","|"])
+        if total:
+            txt += " %s/%s"%(done,total)
         txt = assets.get_font("loading").render(txt,1,[200,100,100])
         pygame.screen.blit(txt,[50,50])
         self.draw_screen(0)
@@ -886,8 +1067,13 @@ set _font_new_resume_size 14""".split("\n"):
         game = os.path.normpath(game).replace("\\","/")
         self.last_autosave = time.time()
         self.clear()
+        self.art_cache.clear()
+        self.meta_cache.clear()
+        self.prefetcher.clear()
         self.game = game
         self.registry = registry.combine_registries("./"+self.game,self.show_load)
+        if self.preparse_meta:
+            self.parse_all_meta()
         self.stack.append(self.Script())
         if mode == "casemenu" and not os.path.exists(game+"/"+script+".txt"):
             self.cur_script.obs = [bg("main"),bg("main"),case_menu(game)]
@@ -918,7 +1104,7 @@ def subscript(macro):
     print "end subscript",script.scene
     
 
-class SoundEvent(object):
+class SoundEvent(gui.watched):
     kill = 0
     pri = -1000000
     def __init__(self,name,after=0):
@@ -935,6 +1121,8 @@ class SoundEvent(object):
         return False
     def draw(self,*args):
         pass
+    def draw_region(self):
+        return [0,0,0,0],None
 
 def color_str(rgbstring):
     if rgbstring.startswith(" "):
@@ -1151,6 +1339,37 @@ class sprite(gui.button):
             pos[0]+=os[0]//2-ns[0]//2
             pos[1]+=os[1]//2-ns[1]//2
         dest.blit(img,pos)
+    def draw_region(self):
+        """(rect,state) for what draw would show now, see core/dirtyrects,
+        or None if it can't tell"""
+        if self.__class__.draw.im_func in [sprite.draw.im_func,fadesprite.draw.im_func]:
+            return self.sprite_region()
+    def sprite_region(self):
+        """(rect,state) for what sprite.draw or fadesprite.draw shows"""
+        img = getattr(self,"img",None)
+        fade = getattr(self,"fade",None)
+        if not img or fade==0:
+            return [0,0,0,0],None
+        if hasattr(img,"ori"):
+            return None
+        pos = self.getpos()
+        if hasattr(self,"offsetx"): pos[0]+=self.offsetx
+        if hasattr(self,"offsety"): pos[1]+=self.offsety
+        w,h = img.get_size()
+        rot = getattr(self,"rot",[0,0,0])
+        dim = getattr(self,"dim",1)
+        if rot[2] or dim != 1:
+            r = int(math.hypot(w,h)*max(dim,1)/2)+2
+            rect = [pos[0]+w//2-r,pos[1]+h//2-r,r*2,r*2]
+        else:
+            rect = [pos[0],pos[1],w,h]
+        x,y = int(math.floor(rect[0])),int(math.floor(rect[1]))
+        rect = [x,y,int(math.ceil(rect[0]+rect[2]))-x+1,int(math.ceil(rect[1]+rect[3]))-y+1]
+        tint = getattr(self,"tint",None)
+        if tint: tint = tuple(tint)
+        state = (id(img),getattr(self,"x",0),tuple(pos),getattr(self,"flipx",0),tuple(rot),dim,
+            fade,getattr(self,"invert",0),tint,getattr(self,"greyscale",0),self.z)
+        return rect,state
     def update(self):
         if self.next>0:
             self.next-=assets.dt
@@ -1561,17 +1780,25 @@ class portrait(sprite):
     def get_dim(self):
         return self.blink_sprite.dim
     dim = property(get_dim,set_dim)
+    def place_sprite(self):
+        """Give cur_sprite the portrait's place and effects"""
+        self.cur_sprite.tint = self.tint
+        self.cur_sprite.greyscale = self.greyscale
+        self.cur_sprite.invert = self.invert
+        pos = self.pos[:]
+        pos[0] += (sw-(self.cur_sprite.offsetx+self.cur_sprite.img.get_width()))//2
+        pos[1] += (sh-(self.cur_sprite.img.get_height()-self.cur_sprite.offsety))
+        self.cur_sprite.pos = pos
+        self.cur_sprite.rot = self.rot[:]
     def draw(self,dest):
         if not self.hide and getattr(self.cur_sprite,"img",None):
-            self.cur_sprite.tint = self.tint
-            self.cur_sprite.greyscale = self.greyscale
-            self.cur_sprite.invert = self.invert
-            pos = self.pos[:]
-            pos[0] += (sw-(self.cur_sprite.offsetx+self.cur_sprite.img.get_width()))//2
-            pos[1] += (sh-(self.cur_sprite.img.get_height()-self.cur_sprite.offsety))
-            self.cur_sprite.pos = pos
-            self.cur_sprite.rot = self.rot[:]
+            self.place_sprite()
             self.cur_sprite.draw(dest)
+    def draw_region(self):
+        if not self.hide and getattr(self.cur_sprite,"img",None):
+            self.place_sprite()
+            return self.cur_sprite.draw_region()
+        return [0,0,0,0],None
     def delete(self):
         self.kill = 1
     def update(self):
@@ -1764,6 +1991,10 @@ class testimony_blink(fg):
         if self.time>20 and vtrue(assets.variables.get("_testimony_blinker", "true")):
             w,h = self.img.get_size()
             dest.blit(pygame.transform.scale(self.img,[int(w//1.5),int(h//1.5)]),self.pos)
+    def draw_region(self):
+        """Blinks as it is drawn, so is drawn again every frame"""
+        w,h = self.img.get_size()
+        return [0,22,int(w//1.5),int(h//1.5)],None
     
 class press_button(fadesprite,gui.widget):
     def __init__(self,parent):
@@ -1779,6 +2010,9 @@ class press_button(fadesprite,gui.widget):
     def draw(self,dest):
         self.img = {False:self.normal,True:self.high}[self.highlight is True]
         super(press_button,self).draw(dest)
+    def draw_region(self):
+        self.img = {False:self.normal,True:self.high}[self.highlight is True]
+        return self.sprite_region()
     def click_down_over(self,mp):
         self.parent.k_z()
 
@@ -1797,6 +2031,9 @@ class present_button(fadesprite,gui.widget):
     def draw(self,dest):
         self.img = {False:self.normal,True:self.high}[self.highlight is True]
         super(present_button,self).draw(dest)
+    def draw_region(self):
+        self.img = {False:self.normal,True:self.high}[self.highlight is True]
+        return self.sprite_region()
     def click_down_over(self,mp):
         self.parent.k_x()
 
@@ -1949,60 +2186,66 @@ class textbox(gui.widget):
             self.delete()
         if sound:
             assets.play_sound("bloop.ogg",volume=0.7)
-    def draw(self,dest):
-        self.children = []
-        if not self.go or self.kill:
-            return
+    def layout(self):
+        """[[image,pos]] for the box, its pointers and the nametag"""
+        blits = []
         #For the widget
         x = assets.variables.get("_textbox_x","")
         y = assets.variables.get("_textbox_y","")
         self.rpos1 = [(sw-self.img.get_width())/2,
             sh-self.img.get_height()]
         if x!="":
-            self.rpos1[0] = int(x)
+            self.rpos1[0] = assets.variables.vint("_textbox_x")
         if y!="":
-            self.rpos1[1] = int(y)
+            self.rpos1[1] = assets.variables.vint("_textbox_y")
         self.width1 = self.img.get_width()
         self.height1 = self.img.get_height()
-        dest.blit(self.img,
-            self.rpos1)
+        blits.append([self.img,
+            self.rpos1])
         if self.rightp and self.nextline():
-            dest.blit(self.rpi.img,[self.rpos1[0]+self.width1-16,
-                self.rpos1[1]+self.height1-16])
+            blits.append([self.rpi.img,[self.rpos1[0]+self.width1-16,
+                self.rpos1[1]+self.height1-16]])
         if getattr(self,"showleft",False) and self.nextline():
-            dest.blit(pygame.transform.flip(self.rpi.img,1,0),[self.rpos1[0],
-                self.rpos1[1]+self.height1-16])
+            blits.append([pygame.transform.flip(self.rpi.img,1,0),[self.rpos1[0],
+                self.rpos1[1]+self.height1-16]])
         #End
         x = assets.variables.get("_nt_x","")
         y = assets.variables.get("_nt_y","")
         if self.nt_full:
             nx,ny = self.rpos1[0],(self.rpos1[1]-self.nt_full.get_height())
             if x!="":
-                nx = int(x)
+                nx = assets.variables.vint("_nt_x")
             if y!="":
-                ny = int(y)
-            dest.blit(self.nt_full,[nx,ny])
+                ny = assets.variables.vint("_nt_y")
+            blits.append([self.nt_full,[nx,ny]])
             if self.nt_text_image:
                 if assets.variables.get("_nt_text_x","")!="":
-                    nx += int(assets.variables.get("_nt_text_x",0))
+                    nx += assets.variables.vint("_nt_text_x",0)
                 if assets.variables.get("_nt_text_y","")!="":
-                    ny += int(assets.variables.get("_nt_text_y",0))
-                dest.blit(self.nt_text_image,[nx+5,ny])
+                    ny += assets.variables.vint("_nt_text_y",0)
+                blits.append([self.nt_text_image,[nx+5,ny]])
         elif self.nt_left and self.nt_text_image:
             nx,ny = self.rpos1[0],(self.rpos1[1]-self.nt_left.get_height())
             if x!="":
-                nx = int(x)
+                nx = assets.variables.vint("_nt_x")
             if y!="":
-                ny = int(y)
-            dest.blit(self.nt_left,[nx,ny])
+                ny = assets.variables.vint("_nt_y")
+            blits.append([self.nt_left,[nx,ny]])
             for ii in range(self.nt_text_image.get_width()+8):
-                dest.blit(self.nt_middle,[nx+3+ii,ny])
-            dest.blit(self.nt_right,[nx+3+ii+1,ny])
+                blits.append([self.nt_middle,[nx+3+ii,ny]])
+            blits.append([self.nt_right,[nx+3+ii+1,ny]])
             if assets.variables.get("_nt_text_x","")!="":
-                nx += int(assets.variables.get("_nt_text_x",0))
+                nx += assets.variables.vint("_nt_text_x",0)
             if assets.variables.get("_nt_text_y","")!="":
-                ny += int(assets.variables.get("_nt_text_y",0))
-            dest.blit(self.nt_text_image,[nx+5,ny])
+                ny += assets.variables.vint("_nt_text_y",0)
+            blits.append([self.nt_text_image,[nx+5,ny]])
+        return blits
+    def draw(self,dest):
+        self.children = []
+        if not self.go or self.kill:
+            return
+        for img,pos in self.layout():
+            dest.blit(img,pos)
         if self.statement:
             h1=h2=False
             for o in assets.cur_script.obs:
@@ -2165,6 +2408,16 @@ class textbox(gui.widget):
         t = textutil.markup_text()
         t._text = self.mwritten
         return not len(self.mwritten)<len(self._markup._text) or len(t.fulltext().split("\n"))>=self.num_lines
+    def draw_region(self):
+        """Where the box and nametag go. update renders self.img again from
+        mwritten each frame, so the state is what that depends on rather than
+        the image, and a box which has finished writing stays clean."""
+        if not self.go or self.kill:
+            return [0,0,0,0],None
+        rects = [[int(pos[0]),int(pos[1])]+list(img.get_size()) for img,pos in self.layout()]
+        state = (len(self.mwritten),id(self._markup),self.nametag,self.nextline(),id(self.rpi.img),
+            assets.variables.get("_textbox_lines",""),tuple([tuple(r) for r in rects]))
+        return dirtyrects.bounding(rects),state
     def update(self):
         #assets.play_sound(self.clicksound)
         self.rpi.update()
@@ -2316,6 +2569,18 @@ class uglyarrow(fadesprite):
             self.border_bottom.pos[0] = self.pos[0]
             self.border_bottom.pos[1] = self.pos[1]+192-self.border_bottom.height
             self.border_bottom.draw(dest)
+    def draw_region(self):
+        own = self.sprite_region()
+        if own is None:
+            return None
+        pos = self.getpos()
+        rect = [int(pos[0]),int(pos[1]),sw,sh]
+        if own[0][2]:
+            rect = dirtyrects.union(rect,own[0])
+        state = (own[1],self.button and id(self.button.img),self.double and id(self.double.img),
+            id(self.arrow.img),self.can_click(),self.showleft,
+            assets.variables.get("_screen2_scanlines","off"),assets.variables.get("_screen2_letterbox","on"))
+        return rect,state
     def over(self,mp):
         if self.button:
             if mp[0]>=self.button.pos[0] and mp[1]>=self.button.pos[1]\
@@ -2948,7 +3213,7 @@ class examine_menu(sprite,gui.widget):
         if not assets.variables.get("_examine_use",None):
             [dest.blit(o.img,[o.pos[0],o.pos[1]+self.getpos()[1]]) for o in self.bg]
         my = self.my+self.getpos()[1]
-        if vtrue(assets.variables.get("_examine_showcursor", "true")):
+        if assets.variables.vbool("_examine_showcursor","true"):
             if assets.variables.get("_examine_cursor_img","").strip():
                 spr = sprite(0,0)
                 spr.load(assets.variables.get("_examine_cursor_img",""))
@@ -2962,7 +3227,7 @@ class examine_menu(sprite,gui.widget):
                 pygame.draw.line(dest,col,[self.mx,self.getpos()[1]],[self.mx,my-5])
                 pygame.draw.line(dest,col,[self.mx,my+5],[self.mx,self.getpos()[1]+sh])
                 pygame.draw.rect(dest,col,[[self.mx-5,my-5],[10,10]],1)
-        if vtrue(assets.variables.get("_examine_showbars", "true")):
+        if assets.variables.vbool("_examine_showbars","true"):
             dest.blit(self.fg,[0,self.getpos()[1]])
         if self.selected != [None] and not self.hide:
             dest.blit(self.check,[sw-self.check.get_width()+3,self.getpos()[1]+sh-self.check.get_height()])
@@ -3001,12 +3266,12 @@ class examine_menu(sprite,gui.widget):
                 x.pos[0]-=d[0]
                 x.pos[1]-=d[1]
             [add(x) for x in self.bg]
-            x = float(assets.variables.get("_examine_offsetx",0))
-            y = float(assets.variables.get("_examine_offsety",0))
+            x = assets.variables.vfloat("_examine_offsetx",0)
+            y = assets.variables.vfloat("_examine_offsety",0)
             x-=d[0]
             y-=d[1]
-            assets.variables["_examine_offsetx"] = str(x)
-            assets.variables["_examine_offsety"] = str(y)
+            assets.variables.vset("_examine_offsetx",x)
+            assets.variables.vset("_examine_offsety",y)
             self.highlight()
             return False
         self.highlight()
@@ -3402,7 +3667,7 @@ class evidence_menu(fadesprite,gui.widget):
         #assets.cur_script.cross = ""
         #assets.cur_script.instatement = False
     def canback(self):
-        show_back = vtrue(assets.variables.get("_cr_back_button", "true")) and not getattr(self,"noback",False)
+        show_back = assets.variables.vbool("_cr_back_button","true") and not getattr(self,"noback",False)
         if self.mode!="overview" or show_back:
             return True
         return False
@@ -3412,19 +3677,19 @@ class evidence_menu(fadesprite,gui.widget):
         dest.blit(self.img,pos)
         x,y=pos
         if not assets.gbamode:
-            if vtrue(assets.variables["ev_show_mode_text"]):
+            if assets.variables.vbool("ev_show_mode_text"):
                 dest.blit(assets.get_image_font("itemset").render(self.item_set.capitalize(),[255,255,255]),
-                [x+int(assets.variables["ev_mode_x"]),y+int(assets.variables["ev_mode_y"])])
+                [x+assets.variables.vint("ev_mode_x"),y+assets.variables.vint("ev_mode_y")])
         name = ""
         if self.chosen:
             name = assets.variables.get(self.chosen+"_name",self.chosen).replace("$","")
         if not assets.gbamode or self.mode != "zoomed":
             dest.blit(assets.get_image_font("itemname").render(name,[255,255,255]),
-            [x+int(assets.variables["ev_currentname_x"]),y+int(assets.variables["ev_currentname_y"])])
-        if vtrue(assets.variables.get("_evidence_enabled","true")) and vtrue(assets.variables.get("_profiles_enabled","true")):
+            [x+assets.variables.vint("ev_currentname_x"),y+assets.variables.vint("ev_currentname_y")])
+        if assets.variables.vbool("_evidence_enabled","true") and assets.variables.vbool("_profiles_enabled","true"):
             dest.blit(assets.get_font("itemset_big").render(
                 self.next_screen().capitalize(),1,[255,255,255]),
-                [x+int(assets.variables["ev_modebutton_x"]),y+int(assets.variables["ev_modebutton_y"])])
+                [x+assets.variables.vint("ev_modebutton_x"),y+assets.variables.vint("ev_modebutton_y")])
         if self.can_present():
             self.present_button.draw(dest)
         page = []
@@ -3432,11 +3697,11 @@ class evidence_menu(fadesprite,gui.widget):
             page = self.pages[self.page]
         if self.mode != "zoomed":
             cx,cy=0,0
-            sx = pos[0]+int(assets.variables["ev_items_x"])
-            sy = pos[1]+int(assets.variables["ev_items_y"])
+            sx = pos[0]+assets.variables.vint("ev_items_x")
+            sy = pos[1]+assets.variables.vint("ev_items_y")
             x,y = sx,sy
-            w = int(assets.variables["ev_spacing_x"])
-            h = int(assets.variables["ev_spacing_y"])
+            w = assets.variables.vint("ev_spacing_x")
+            h = assets.variables.vint("ev_spacing_y")
             for line in page:
                 for icon in line:
                     icon.reload()
@@ -3453,11 +3718,11 @@ class evidence_menu(fadesprite,gui.widget):
                 cy+=1
             if len(self.pages)>1:
                 arr = assets.open_art(assets.variables["ev_arrow_img"])[0]
-                dest.blit(arr,[pos[0]+int(assets.variables["ev_rarrow_x"]),
-                            pos[1]+int(assets.variables["ev_rarrow_y"])])
+                dest.blit(arr,[pos[0]+assets.variables.vint("ev_rarrow_x"),
+                            pos[1]+assets.variables.vint("ev_rarrow_y")])
                 dest.blit(pygame.transform.flip(arr,1,0),
-                    [pos[0]+int(assets.variables["ev_larrow_x"]),
-                    pos[1]+int(assets.variables["ev_larrow_y"])])
+                    [pos[0]+assets.variables.vint("ev_larrow_x"),
+                    pos[1]+assets.variables.vint("ev_larrow_y")])
         if self.mode == "zoomed":
             showarrow = 0
             for p in self.pages:
@@ -3467,11 +3732,11 @@ class evidence_menu(fadesprite,gui.widget):
             if showarrow>1:
                 if not getattr(self,"arr",None):
                     self.arr = assets.open_art(assets.variables["ev_zarrow_img"])[0]
-                dest.blit(self.arr,[pos[0]+int(assets.variables["ev_zrarrow_x"]),
-                                pos[1]+int(assets.variables["ev_zrarrow_y"])])
+                dest.blit(self.arr,[pos[0]+assets.variables.vint("ev_zrarrow_x"),
+                                pos[1]+assets.variables.vint("ev_zrarrow_y")])
                 dest.blit(pygame.transform.flip(self.arr,1,0),
-                    [pos[0]+int(assets.variables["ev_zlarrow_x"]),
-                    pos[1]+int(assets.variables["ev_zlarrow_y"])])
+                    [pos[0]+assets.variables.vint("ev_zlarrow_x"),
+                    pos[1]+assets.variables.vint("ev_zlarrow_y")])
             if getattr(self,"chosen_icon",None) and getattr(self,"chosen",None):
                 if self.scroll:
                     self.scroll -= 16*assets.dt
@@ -3559,6 +3824,8 @@ class waitenter(sprite):
         super(waitenter,self).__init__()
         self.pri = ulayers.index(self.__class__.__name__)
     def draw(self,dest): pass
+    def draw_region(self):
+        return [0,0,0,0],None
     def update(self):
         return True
     def enter_down(self):
@@ -3570,6 +3837,8 @@ class delay(sprite):
         self.ticks = abs(ticks)
         self.pri = ulayers.index(self.__class__.__name__)
     def draw(self,dest): pass
+    def draw_region(self):
+        return [0,0,0,0],None
     def update(self):
         if self.ticks<=0:
             self.delete()
@@ -3592,12 +3861,18 @@ class timer(sprite):
             if self.run:
                 ns = self.script.execute_macro(self.run)
         
-class effect(object):
+class effect(gui.watched):
     id_name = "_effect_"
     def __init__(self):
         self.z = zlayers.index(self.__class__.__name__)
     def delete(self):
         self.kill = 1
+    def draw(self,dest): pass
+    def draw_region(self):
+        """Most effects change other objects and draw nothing themselves,
+        those that draw over the screen can't tell where"""
+        if self.__class__.draw.im_func is effect.draw.im_func:
+            return [0,0,0,0],None
                 
 class scroll(effect):
     def __init__(self,amtx=1,amty=1,amtz=1,speed=1,wait=1,filter="top",ramp=-.005):
@@ -3633,7 +3908,6 @@ class scroll(effect):
         self.obs = assets.cur_script.obs
         self.filter = filter
         self.wait = wait
-    def draw(self,dest): pass
     def update(self):
         ndx,ndy,ndz = self.dx*assets.dt,self.dy*assets.dt,self.dz*assets.dt
         #print "before - ndx:",ndx,"self.amtx:",self.amtx
@@ -3676,10 +3950,10 @@ class scroll(effect):
             raise missing_object("Scroll: no objects found to scroll")
     def control(self,name):
         self.filter = None
-        for o in reversed(assets.cur_script.obs):
-            if getattr(o,"id_name",None)==name:
-                self.obs = [o]
-                return
+        world = assets.cur_script.world
+        for o in reversed(world.in_render_order(world.named(name))):
+            self.obs = [o]
+            return
         if vtrue(assets.variables.get("_debug","false")):
             raise missing_object("Scroll: no object named "+str(name)+" found")
                 
@@ -3693,7 +3967,6 @@ class zoomanim(effect):
         self.mag_per_frame = float(self.mag)/float(self.frames)
         self.wait = wait
         self.kill = 0
-    def draw(self,dest): pass
     def update(self):
         if self.kill: return False
         self.frames -= assets.dt
@@ -3714,10 +3987,10 @@ class zoomanim(effect):
             raise missing_object("zoom: no objects found to zoom")
     def control(self,name):
         self.filter = None
-        for o in reversed(assets.cur_script.obs):
-            if getattr(o,"id_name",None)==name:
-                self.obs = [o]
-                return
+        world = assets.cur_script.world
+        for o in reversed(world.in_render_order(world.named(name))):
+            self.obs = [o]
+            return
         if vtrue(assets.variables.get("_debug","false")):
             raise missing_object("zoom: no object named "+str(name)+" found")
 
@@ -3735,7 +4008,6 @@ class rotateanim(effect):
             self.obs = [o for o in self.obs if getattr(o,"id_name",None)==name]
             if not self.obs and vtrue(assets.variables.get("_debug","false")):
                 raise missing_object("rotate: no object named "+str(name)+" found")
-    def draw(self,dest): pass
     def update(self):
         if self.kill: return False
         amt = self.speed*assets.dt
@@ -3776,7 +4048,6 @@ class fadeanim(effect):
             if not self.obs and vtrue(assets.variables.get("_debug","false")):
                 raise missing_object("fade: no object named "+str(name)+" found")
         self.update()
-    def draw(self,dest): pass
     def update(self):
         if self.kill: return False
         amt = self.speed*assets.dt
@@ -3820,7 +4091,6 @@ class tintanim(effect):
             if not self.obs and vtrue(assets.variables.get("_debug","false")):
                 raise missing_object("tint: no object named "+str(name)+" found")
         self.update()
-    def draw(self,dest): pass
     def update(self):
         if self.kill: return False
         amt = self.speed*assets.dt
@@ -3863,7 +4133,6 @@ class invertanim(effect):
             if not self.obs and vtrue(assets.variables.get("_debug","false")):
                 raise missing_object("invert: no object named "+str(name)+" found")
         self.update()
-    def draw(self,dest): pass
     def update(self):
         if self.kill: return False
         amt = self.speed
@@ -3901,7 +4170,6 @@ class greyscaleanim(effect):
             if not self.obs and vtrue(assets.variables.get("_debug","false")):
                 raise missing_object("greyscale: no object named "+str(name)+" found")
         self.update()
-    def draw(self,dest): pass
     def update(self):
         if self.kill: return False
         amt = self.speed
@@ -4144,7 +4412,7 @@ class script_code(gui.pane):
     def update(self):
         return True
         
-class movie:
+class movie(gui.watched):
     def __init__(self,name,sound=None):
         self.movie = assets.open_movie(name)
         self.movie.set_volume(0)
@@ -0,0 +1,104 @@
+"""Dirty rectangles for the back buffer, so a frame where little moved only
+clears and draws the parts of the screen that changed.
+
+Each frame the objects to be drawn report the rect they cover and a state
+which changes whenever what they draw there does. Comparing that with the
+last frame gives the rects to draw again. An object that can't tell where
+it draws reports no rect, and both that frame and the next are drawn in full.
+
+Rects are [x,y,width,height] lists."""
+import math
+
+def union(a,b):
+    x = min(a[0],b[0])
+    y = min(a[1],b[1])
+    return [x,y,max(a[0]+a[2],b[0]+b[2])-x,max(a[1]+a[3],b[1]+b[3])-y]
+
+def overlaps(a,b):
+    return a[0]<b[0]+b[2] and b[0]<a[0]+a[2] and a[1]<b[1]+b[3] and b[1]<a[1]+a[3]
+
+def clip(rect,bounds):
+    """Part of rect inside bounds, or None"""
+    x = max(rect[0],bounds[0])
+    y = max(rect[1],bounds[1])
+    w = min(rect[0]+rect[2],bounds[0]+bounds[2])-x
+    h = min(rect[1]+rect[3],bounds[1]+bounds[3])-y
+    if w<=0 or h<=0:
+        return None
+    return [x,y,w,h]
+
+def merge(rects):
+    """Rects joined together until none of them overlap"""
+    merged = True
+    while merged:
+        merged = False
+        out = []
+        for r in rects:
+            for i,o in enumerate(out):
+                if overlaps(r,o):
+                    out[i] = union(r,o)
+                    merged = True
+                    break
+            else:
+                out.append(r)
+        rects = out
+    return rects
+
+def bounding(rects):
+    rect = rects[0]
+    for r in rects[1:]:
+        rect = union(rect,r)
+    return rect
+
+def scale_rect(rect,src,dest):
+    """Part of rect inside src, moved and scaled to where src is shown as dest,
+    a pixel bigger each way for the blending smoothscale does"""
+    rect = clip(rect,src)
+    if not rect:
+        return None
+    sx = dest[2]/float(src[2])
+    sy = dest[3]/float(src[3])
+    x = int(math.floor(dest[0]+(rect[0]-src[0]-1)*sx))
+    y = int(math.floor(dest[1]+(rect[1]-src[1]-1)*sy))
+    return [x,y,int(math.ceil(dest[0]+(rect[0]-src[0]+rect[2]+1)*sx))-x,
+        int(math.ceil(dest[1]+(rect[1]-src[1]+rect[3]+1)*sy))-y]
+
+class Tracker(object):
+    full_area = 0.6  #Draw everything when more than this much of the screen changed
+    max_rects = 12  #Join into one rect when there are more than this many
+    def __init__(self,size):
+        self.size = size
+        self.reset()
+    def reset(self):
+        """Draw the whole screen next frame"""
+        self.last = None
+    def frame(self,regions):
+        """Rects to draw again for regions [(key,rect,state)] of this frame,
+        or None to draw everything. A state of None changes every frame."""
+        current = {}
+        for key,rect,state in regions:
+            if rect is None:
+                self.last = None
+                return None
+            current[key] = rect,state
+        last,self.last = self.last,current
+        if last is None:
+            return None
+        rects = []
+        for key,(rect,state) in current.items():
+            old = last.get(key,None)
+            if old is None:
+                rects.append(rect)
+            elif state is None or old!=(rect,state):
+                rects.append(rect)
+                rects.append(old[0])
+        for key,(rect,state) in last.items():
+            if key not in current:
+                rects.append(rect)
+        bounds = [0,0,self.size[0],self.size[1]]
+        rects = merge([r for r in [clip(r,bounds) for r in rects] if r])
+        if len(rects)>self.max_rects:
+            rects = [bounding(rects)]
+        if sum([r[2]*r[3] for r in rects])>self.full_area*bounds[2]*bounds[3]:
+            return None
+        return rects
@@ -34,7 +34,25 @@ defcol = {
 "gamebg":[225,223,175],
 }
 
-class widget(object):
+class watched(object):
+    """Base for objects put in a World. Setting one of the attributes a world
+    indexes or sorts by tells the worlds the object is in, through changed."""
+    watched_attrs = ("id_name","z","pri")
+    def __setattr__(self,name,value):
+        if name in self.watched_attrs:
+            worlds = self.__dict__.get("_worlds",None)
+            if worlds:
+                old = getattr(self,name,None)
+                object.__setattr__(self,name,value)
+                if old!=value:
+                    for ref in worlds.values():
+                        world = ref()
+                        if world:
+                            world.changed(self,name,old)
+                return
+        object.__setattr__(self,name,value)
+
+class widget(watched):
     visible = 1
     mouse_pos = property(lambda x: pygame.mouse.get_pos())
     def __init__(self,pos=[0,0],size=[0,0],parent=None):
@@ -0,0 +1,80 @@
+"""Composites of the objects on screen which have stopped changing, such as
+the background, the bench and a portrait between blinks, so a frame draws
+them with one blit instead of one each.
+
+Objects come in render order as (object,rect,state), as Script.draw_regions
+gives them. One which has drawn the same for settle frames is flattened,
+unless something drawn before it that is still changing overlaps it, as it
+would then end up under that instead of over it. Flattened objects are kept
+in one composite per layer of z, each drawn over the one below, so a change
+only means building again from the layer it is in."""
+import dirtyrects
+
+class LayerCache(object):
+    settle = 30  #Frames an object has to draw the same before it is flattened
+    def __init__(self,new,draw):
+        """new(below) gives a surface with the pixels of the composite below,
+        or the blank screen for None, and draw(surface,objects) draws on it"""
+        self.new = new
+        self.draw = draw
+        self.hits = 0
+        self.misses = 0
+        self.reset()
+    def reset(self):
+        self.layers = []  #[signature,surface] from the bottom layer up
+        self.seen = {}  #id(object):[(rect,state),frames it has stayed the same]
+    def take_counts(self):
+        """Frames drawn with the composites as they were, and frames which
+        had to build some, since last asked"""
+        counts = self.hits,self.misses
+        self.hits = self.misses = 0
+        return counts
+    def split(self,regions):
+        """Layers [(z,[(object,rect,state)])] to flatten, and the regions to draw over them"""
+        seen = {}
+        layers = []
+        rest = []
+        later = []
+        for ob,rect,state in regions:
+            key = id(ob)
+            last = self.seen.get(key,None)
+            age = 0
+            if state is not None and last and last[0]==(rect,state):
+                age = last[1]+1
+            seen[key] = [(rect,state),age]
+            if age>=self.settle and later is not None and not [r for r in later if dirtyrects.overlaps(r,rect)]:
+                z = getattr(ob,"z",0)
+                if not layers or layers[-1][0]!=z:
+                    layers.append((z,[]))
+                layers[-1][1].append((ob,rect,state))
+                continue
+            rest.append((ob,rect,state))
+            if rect is None:
+                later = None
+            elif later is not None:
+                later.append(rect)
+        self.seen = seen
+        return layers,rest
+    def composite(self,regions):
+        """Surface with the flattened objects drawn on the blank screen, or
+        None if there are none, and the regions left to draw over it"""
+        layers,rest = self.split(regions)
+        signatures = [(z,[(id(ob),rect,state) for ob,rect,state in obs]) for z,obs in layers]
+        keep = 0
+        while keep<len(self.layers) and keep<len(layers) and self.layers[keep][0]==signatures[keep]:
+            keep += 1
+        del self.layers[keep:]
+        if not layers:
+            return None,rest
+        if keep==len(layers):
+            self.hits += 1
+        else:
+            self.misses += 1
+        for i in range(keep,len(layers)):
+            below = None
+            if self.layers:
+                below = self.layers[-1][1]
+            surface = self.new(below)
+            self.draw(surface,[ob for ob,rect,state in layers[i][1]])
+            self.layers.append([signatures[i],surface])
+        return self.layers[-1][1],rest
@@ -5,6 +5,8 @@ from errors import script_error
 
 import pickle
 import zlib
+import operator
+import weakref
 import os,sys
 sys.path.append("core/include")
 sys.path.append("include")
@@ -18,6 +20,10 @@ import load
 from pwvlib import *
 import settings
 import tools_menu
+import scriptcompile
+import scriptexpr
+import dirtyrects
+import layercache
 
 try:
     import android
@@ -113,32 +119,99 @@ def parseargs(arglist,intvals=[],defaults = {},setzero = {}):
             kwargs[str(a)] = 1
     return kwargs,args
     
-def argsort(list,arg="pri",get=getattr):
-    def _cmp(a,b):
-        return cmp(get(a,arg),get(b,arg))
-    list.sort(_cmp)
-def getz(ob,arg):
-    v = getattr(ob,arg)
-    if type(v)==type(""):
-        v = assets.variables.get(v,0)
-    return v
-
 class mylist(list): pass
-class World:
-    """A collection of objects"""
+class World(object):
+    """A collection of objects, indexed by id_name and by class. Killed objects
+    stay in the world until compact, which the main loop runs once a frame.
+    Objects derived from gui.watched call changed when id_name, z or pri is
+    set, which keeps the index and the sorted orders current."""
     def __init__(self,obs=None):
         if not obs: obs = []
         self.all = obs[:]
         for o in self.all:
             o.cur_script = assets.cur_script
+    def get_all(self):
+        return self._all
+    def set_all(self,obs):
+        self._all = obs
+        self.reindex()
+    all = property(get_all,set_all)
+    def reindex(self):
+        self.orders = {}  #arg:objects sorted by arg
+        self.names = {}  #id_name:[objects]
+        self.classes = {}  #class:[objects]
+        self.added = {}  #id(object):count when it was indexed, to keep merged lists in order
+        self.count = 0
+        for o in self._all:
+            self.index(o)
+    def index(self,ob):
+        self.names.setdefault(getattr(ob,"id_name",None),[]).append(ob)
+        self.classes.setdefault(ob.__class__,[]).append(ob)
+        self.added[id(ob)] = self.count
+        self.count += 1
+        ob.__dict__.setdefault("_worlds",{})[id(self)] = weakref.ref(self)
+    def unindex(self,ob):
+        names = self.names.get(getattr(ob,"id_name",None),[])
+        if ob not in names:
+            #Not a gui.watched object, renamed without telling the world
+            names = [l for l in self.names.values() if ob in l][0]
+        names.remove(ob)
+        self.classes[ob.__class__].remove(ob)
+        del self.added[id(ob)]
+        ob.__dict__.get("_worlds",{}).pop(id(self),None)
+    def changed(self,ob,name,old):
+        """ob set name, which was old, to something else"""
+        if id(ob) not in self.added:
+            return
+        if name!="id_name":
+            self.orders.pop(name,None)
+            return
+        self.names[old].remove(ob)
+        names = self.names.setdefault(ob.id_name,[])
+        at = len(names)
+        while at and self.added[id(names[at-1])]>self.added[id(ob)]:
+            at -= 1
+        names.insert(at,ob)
+    def in_order(self,lists):
+        if len(lists)==1:
+            return lists[0][:]
+        obs = [o for l in lists for o in l]
+        obs.sort(key=lambda o:self.added[id(o)])
+        return obs
+    def named(self,*names):
+        """Objects with one of the id_names, in the order they were added"""
+        return self.in_order([self.names.get(name,[]) for name in names])
+    def instances(self,cls):
+        """Objects which are instances of cls, in the order they were added"""
+        return self.in_order([obs for c,obs in self.classes.items() if issubclass(c,cls)] or [[]])
+    def in_render_order(self,obs):
+        """Some of the objects, sorted the way render_order sorts them"""
+        if assets.variables.get("_layering_method","zorder") == "zorder":
+            obs.sort(key=operator.attrgetter("z"))
+        return obs
+    def compact(self):
+        """Remove killed objects in one pass, calling their unadd first"""
+        killed = [o for o in self.render_order() if getattr(o,"kill",0)]
+        if not killed:
+            return
+        for o in killed:
+            if hasattr(o,"unadd"):
+                o.unadd()
+        self.all = [o for o in self._all if not getattr(o,"kill",0)]
+    def sorted_by(self,arg):
+        """Objects sorted by arg, only sorted again after objects were added or
+        removed or one of them set arg"""
+        obs = self.orders.get(arg,None)
+        if obs is None:
+            obs = self.orders[arg] = sorted(self._all,key=operator.attrgetter(arg))
+        return obs
     def render_order(self):
         """Return a list of objects in the order they should
         be rendered"""
-        n = mylist(self.all[:])
         if assets.variables.get("_layering_method","zorder") == "zorder":
-            argsort(n,"z")
+            n = mylist(self.sorted_by("z"))
         else:
-            pass
+            n = mylist(self.all[:])
         oldapp = n.append
         def _app(ob):
             self.append(ob)
@@ -148,23 +221,28 @@ class World:
     def update_order(self):
         """Return a list of objects in the order they
         should be updated"""
-        n = self.all[:]
-        argsort(n,"pri")
-        return n
+        return self.sorted_by("pri")[:]
     def select(self):
         """Return a list of objects that match the query"""
     def append(self,ob):
-        self.all.append(ob)
+        self._all.append(ob)
+        self.index(ob)
+        self.orders = {}
         ob.cur_script = assets.cur_script
     def extend(self,obs,unique=True):
         if unique:
             for o in obs:
-                if o not in self.all:
-                    self.all.append(o)
+                if id(o) not in self.added:
+                    self._all.append(o)
+                    self.index(o)
+            self.orders = {}
         else:
-            self.all.extend(o)
+            for o in obs:
+                self.append(o)
     def remove(self,ob):
-        self.all.remove(ob)
+        self._all.remove(ob)
+        self.unindex(ob)
+        self.orders = {}
 assets.World = World
 
 def INT(n):
@@ -172,152 +250,11 @@ def INT(n):
         return int(n)
     except:
         return float(n)
-def EVAL(stuff):
-    stuff = stuff.split(" ",2)
-    if len(stuff)==1:
-        return vtrue(assets.variables.get(stuff[0],""))
-    if len(stuff)==2:
-        stuff = stuff[0],"=",stuff[1]
-    current,op,check = stuff
-    if op not in ["<",">","=","!=","<=",">="]:
-        check = op+" "+check
-        op = "="
-    current = assets.variables.get(current)
-    if op=="=":op="=="
-    if op not in ["==","!="]:
-        current = INT(current)
-        check = INT(check)
-    if op == ">":
-        return current > check
-    elif op == "<":
-        return current < check
-    elif op == "==":
-        return current == check
-    elif op == "!=":
-        return current != check
-    elif op == "<=":
-        return current <= check
-    elif op == ">=":
-        return current >= check
-def GV(v):
-    if v[0].isdigit():
-        if "." in v:
-            return float(v)
-        return int(v)
-    if v.startswith("'") and v.endswith("'"):
-        return v[1:-1]
-    v = assets.variables.get(v,"")
-    if v[0].isdigit():
-        if "." in v:
-            return float(v)
-        return int(v)
-    return v
-def ADD(statements):
-    return GV(statements[0])+GV(statements[1])
-def MUL(statements):
-    return GV(statements[0])*GV(statements[1])
-def MINUS(statements):
-    return GV(statements[0])-GV(statements[1])
-def DIV(statements):
-    return GV(statements[0])/GV(statements[1])
-def EQ(statements):
-    return str(GV(statements[0])==GV(statements[1])).lower()
-def GTEQ(statements):
-    return str(GV(statements[0])>=GV(statements[1])).lower()
-def GT(statements):
-    return str(GV(statements[0])>GV(statements[1])).lower()
-def LT(statements):
-    return str(GV(statements[0])<GV(statements[1])).lower()
-def LTEQ(statements):
-    return str(GV(statements[0])<=GV(statements[1])).lower()
-def AND(statements):
-    if vtrue(statements[0]) and vtrue(statements[1]):
-        return "true"
-    return "false"
-def OR(stuff):
-    for line in stuff:
-        if EVAL(line):
-            return True
-    return False
-def OR2(statements):
-    if vtrue(statements[0]) or vtrue(statements[1]):
-        return "true"
-    return "false"
 def EXPR(line):
-    statements = []
-    cur = ""
-    paren = []
-    quote = []
-    for word in line.split(" "):
-        if not paren and not quote and word == "+":
-            statements.append(ADD)
-        elif not paren and not quote and word == "*":
-            statements.append(MUL)
-        elif not paren and not quote and word == "-":
-            statements.append(MINUS)
-        elif not paren and not quote and word == "/":
-            statements.append(DIV)
-        elif not paren and not quote and word == "==":
-            statements.append(EQ)
-        elif not paren and not quote and word == "<=":
-            statements.append(LTEQ)
-        elif not paren and not quote and word == ">=":
-            statements.append(GTEQ)
-        elif not paren and not quote and word == "<":
-            statements.append(LT)
-        elif not paren and not quote and word == ">":
-            statements.append(GT)
-        elif not paren and not quote and word == "AND":
-            statements.append(AND)
-        elif not paren and not quote and word == "OR":
-            statements.append(OR2)
-        elif word.strip():
-            if paren:
-                if word.endswith(")"):
-                    paren.append(word)
-                    statements.append(EXPR(" ".join(paren)[1:-1]))
-                    paren = []
-                else:
-                    paren.append(word)
-            elif quote:
-                quote.append(word)
-                if word.endswith("'"):
-                    statements.append(" ".join(quote))
-                    quote = []
-            elif word.startswith("(") and word.endswith(")"):
-                statements.append(word[1:-1])
-            elif word.startswith("("):
-                paren.append(word)
-            elif word.startswith("'") and word.endswith("'"):
-                statements.append(word)
-            elif word.startswith("'"):
-                quote.append(word)
-            else:
-                statements.append(word)
-    return statements
+    """Compiled expression for line, see core/scriptexpr"""
+    return scriptexpr.compile_expression(line)
 def EVAL_EXPR(expr):
-    if not isinstance(expr,list):
-        return str(expr)
-    if len(expr)==1:
-        return EVAL_EXPR(expr[0])
-    oop = [MUL,DIV,ADD,MINUS,EQ,LT,GT,LTEQ,GTEQ,OR2,AND]
-    ops = []
-    for i,v in enumerate(expr):
-        if v in oop:
-            ops.append((i,v))
-    if not ops:
-        return str(expr[0])
-    ops.sort(key=lambda x: oop.index(x[1]))
-    op = ops[0]
-    left = expr[op[0]-1:op[0]]
-    right = expr[op[0]+1:op[0]+2]
-    left = EVAL_EXPR(left)
-    right = EVAL_EXPR(right)
-    v = op[1]([left,right])
-    expr[op[0]-1] = v
-    del expr[op[0]]
-    del expr[op[0]]
-    return EVAL_EXPR(expr)
+    return expr(assets.variables)
 
 assert EVAL_EXPR(EXPR("5 + 1 + 3 * 10"))=="36"
 assert EVAL_EXPR(EXPR("2 * (5 + 1)"))=="12"
@@ -339,6 +276,7 @@ assert EVAL_EXPR(EXPR("5 <= 3"))=="false"
 assert EVAL_EXPR(EXPR("5 <= 5"))=="true"
 assert EVAL_EXPR(EXPR("5 <= 6"))=="true"
 
+dispatch = {}  #Script class:command table
 class Script(gui.widget):
     save_me = True
     def __init__(self,parent=None):
@@ -352,6 +290,11 @@ class Script(gui.widget):
         self.lastline = ""  #Remember where we jumped from in a script so we can go back
         self.lastline_value = ""   #Remember last line we executed
         self.held = []
+        self.scriptlines = []
+        self.compiled_for = None  #scriptlines the commands were compiled from
+        self.commands = []
+        self.labels = []
+        self.label_index = {}  #name:[(line,order)], see scriptcompile.label_index
     def __repr__(self):
         return "Script object, scene=%s id=%s line_no=%s"%(self.scene,id(self),self.si)
     obs = property(lambda self: self.world.render_order(),lambda self,val: setattr(self,"world",World(val)))
@@ -467,6 +410,8 @@ class Script(gui.widget):
                 self.scriptlines = ['"error opening script{n}\'%s\'"'%scene]
                 return True
             self.macros = assets.macros
+            self.commands = scriptcompile.compile_script(assets.game+"/"+scene+ext,self.scriptlines)
+            self.compiled_for = self.scriptlines
         self.labels = []
         
         state = "none"
@@ -490,7 +435,7 @@ class Script(gui.widget):
             if line.startswith("statement") and state!="cross":
                 print "append",line
                 self.obs.append(error_msg("'statement' command may only be used between 'cross' and 'endcross'.",line,i,self))
-        
+        self.label_index = scriptcompile.label_index(self.labels)
         return True
     def preload(self):
         old = self.obs[:]
@@ -519,19 +464,23 @@ class Script(gui.widget):
                 pygame.screen.blit(arial14.render("Loading Script...",1,[255,255,255]),[0,100])
                 draw_screen()
         self.obs = old[:]
-    def getline(self):
+    def command_at(self,si):
+        """Compiled command for line si, compiling the lines if they changed"""
+        if self.compiled_for is not self.scriptlines:
+            self.commands = scriptcompile.compile_lines(self.scriptlines)
+            self.compiled_for = self.scriptlines
         try:
-            line = self.scriptlines[self.si]
-            line = line.replace("\t","    ")
-            line = line.replace("\r","").replace("\n","")
-            line = line.rsplit("#",1)[0]
-            line = line.rsplit("//",1)[0]
-            self.lastline_value = line.strip()
-            return line.strip()
+            return self.commands[si]
         except TypeError:
             return
         except IndexError:
             return
+    def getline(self):
+        command = self.command_at(self.si)
+        if command is None:
+            return
+        self.lastline_value = command.text
+        return command.text
     def update_objects(self):
         for o in self.world.update_order():
             if not getattr(o,"kill",None) and o.update():
@@ -571,21 +520,70 @@ class Script(gui.widget):
             return self.safe_exec(self.interpret)
     def add_object(self,ob,single=False):
         if single:
-            for o2 in self.obs[:]:
-                if isinstance(o2,ob.__class__):
-                    o2.delete()
-        self.obs.append(ob)
+            for o2 in self.world.in_render_order(self.world.instances(ob.__class__)):
+                o2.delete()
+        self.world.append(ob)
     def draw(self,screen):
         for o in self.obs:
             if not getattr(o,"hidden",False) and not getattr(o,"kill",False):
                 o.draw(screen)
+        self.draw_debug(screen)
+    def draw_debug(self,screen):
         if vtrue(assets.variables.get("_debug","false")):
             screen.blit(assets.get_font("nt").render("debug",1,[240,240,240]),[220,0])
-    def tboff(self):
+    def draw_regions(self):
+        """[(object,rect,state)] for the objects draw would draw, rect is None
+        for an object which can't tell where it draws. Objects which would
+        draw nothing are left out."""
+        regions = []
         for o in self.obs:
-            if isinstance(o,testimony_blink):
-                self.world.remove(o)
-                break
+            if getattr(o,"hidden",False) or getattr(o,"kill",False):
+                continue
+            region = getattr(o,"draw_region",None)
+            if region:
+                region = region()
+            if region is None:
+                regions.append((o,None,None))
+            elif region[0][2] and region[0][3]:
+                regions.append((o,region[0],region[1]))
+        return regions
+    def draw_dirty(self,screen,tracker,cache):
+        """Draw the parts of screen which changed since the last frame drawn
+        with tracker, see core/dirtyrects, over the objects cache has
+        flattened, see core/layercache. Returns the rects drawn, or None if
+        it drew everything."""
+        if self.__class__.draw.im_func is not Script.draw.im_func:
+            tracker.reset()
+            screen.blit(pygame.blank,[0,0])
+            self.draw(screen)
+            return None
+        regions = self.draw_regions()
+        keys = [(id(o),rect,state) for o,rect,state in regions]
+        if vtrue(assets.variables.get("_debug","false")):
+            keys.append(("debug",[220,0,sw-220,20],True))
+        rects = tracker.frame(keys)
+        base,regions = cache.composite(regions)
+        if base is None:
+            base = pygame.blank
+        if rects is None:
+            screen.blit(base,[0,0])
+            for o,orect,state in regions:
+                o.draw(screen)
+            self.draw_debug(screen)
+            return None
+        for rect in rects:
+            screen.set_clip(rect)
+            screen.blit(base,rect,rect)
+            for o,orect,state in regions:
+                if dirtyrects.overlaps(orect,rect):
+                    o.draw(screen)
+            self.draw_debug(screen)
+        screen.set_clip(None)
+        return rects
+    def tboff(self):
+        for o in self.world.in_render_order(self.world.instances(testimony_blink)):
+            self.world.remove(o)
+            break
     def tbon(self):
         self.add_object(testimony_blink("testimony"),True)
     def state_test_true(self,test):
@@ -593,7 +591,7 @@ class Script(gui.widget):
             return True
         return vtrue(assets.variables.get(test,"false"))
     def refresh_arrows(self,tbox):
-        arrows = [x for x in self.obs if isinstance(x,uglyarrow) and not getattr(x,"kill",0)]
+        arrows = [x for x in self.world.instances(uglyarrow) if not getattr(x,"kill",0)]
         for a in arrows:
             a.delete()
         if vtrue(assets.variables.get("_textbox_show_button","true")):
@@ -607,7 +605,16 @@ class Script(gui.widget):
                 else:
                     u.showleft = True
                     tbox.showleft = True
+    def prefetch(self):
+        """Start loading assets used by the next _prefetch_lookahead lines"""
+        try:
+            lookahead = int(assets.variables.get("_prefetch_lookahead","40"))
+        except ValueError:
+            lookahead = 0
+        if lookahead>0:
+            assets.prefetcher.scan(self,lookahead,assets.variables)
     def interpret(self):
+        self.prefetch()
         self.buildmode = True
         exit = False
         while self.buildmode and not exit:
@@ -618,9 +625,10 @@ class Script(gui.widget):
                 self.si += 1
                 line = self.getline()
             #print "exec(",repr(line),")"
+            command = self.commands[self.si]
             self.si += 1
             assets.variables["_currentline"] = str(self.si)
-            exit = self.execute_line(line)
+            exit = self.execute_command(command)
             if assets.debugging == "step":
                 self.obs.append(script_code(self))
                 return True
@@ -664,37 +672,28 @@ char test
         else:
             tbox.init_normal()
     def execute_line(self,line):
-        if not line:
+        return self.execute_command(scriptcompile.compile_line(line))
+    def execute_command(self,command):
+        if not command.text:
             return
-        if line[0] in [u'"',u'\u201C'] and len(line)>1:
-            if not (line.endswith('"') or line.endswith(u'\u201C')):
-                line = line+u'"'
-            self.call_func("textbox",["textbox",line[1:-1]])
+        if command.textbox:
+            self.call_func("textbox",command.args)
             return True
-        def repvar(x):
-            if x.startswith("$") and not x[1].isdigit():
-                return assets.variables[x[1:]]
-            elif x.startswith("$"):
-                return u""
-            if u"=" in x:
-                spl = x.split(u"=",1)
-                if spl[1].startswith(u"$"):
-                    return spl[0]+u"="+assets.variables[spl[1][1:]]
-            return x
-        args = []
         try:
-            args = [repvar(x) for x in line.split(u" ")]
+            args = command.resolve(assets.variables)
         except KeyError:
-            self.obs.append(error_msg("Variable not defined:",line,self.si,self))
+            self.obs.append(error_msg("Variable not defined:",command.text,self.si,self))
             return True
-        #print repr(args)
-        if self.execute_macro(args[0]," ".join(args[1:])):
+        if self.macros.get(args[0],None) and self.execute_macro(args[0]," ".join(args[1:])):
             return True
         self.call_func(args[0],args)
     def call_func(self,command,args):
-        func = getattr(self,"_"+command,None)
+        table = dispatch.get(self.__class__,None)
+        if table is None:
+            table = dispatch[self.__class__] = scriptcompile.command_table(self.__class__)
+        func = table.get(command,None)
         if func:
-            func(*args)
+            func(self,*args)
         elif vtrue(assets.variables.get("_debug","false")): 
             self.obs.append(error_msg("Invalid command:"+command,line,self.si,self))
             return True
@@ -740,32 +739,20 @@ char test
         else:
             self.si -= 1
     def goto_result(self,name,wrap=False,backup="none"):
-        for o in self.obs:
-            if isinstance(o,guiWait): o.delete()
+        for o in self.world.in_render_order(self.world.instances(guiWait)):
+            o.delete()
         if name.startswith("{") and name.endswith("}"):
             self.execute_macro(name[1:-1])
             return
         name = name.replace(" ","_")
-        wrap=True
-        first = None
         self.lastline = self.si
         self.instatement = False
         assets.variables["_lastline"] = str(self.si)
-        for label,index in self.labels:
-            #print repr(name),repr(label),repr(index)
-            if not first and label==name:
-                first = index
-                assets.variables["_currentlabel"] = label
-            if label == name and index>=self.si:
-                self.si = index+1
-                assets.variables["_currentlabel"] = label
-                return
-            if label == backup and index>self.si:
-                self.si = index+1
-                assets.variables["_currentlabel"] = backup
-                return
-        if first is not None and wrap:
-            self.si = first+1
+        found = scriptcompile.find_label(self.label_index,name,self.si,backup)
+        if found:
+            label,index = found
+            self.si = index+1
+            assets.variables["_currentlabel"] = label
             return
         try:
             name = int(name)-1
@@ -858,17 +845,11 @@ char test
         if label.endswith("?"):
             args.append(label[:-1])
             label = "?"
-        sentance = ""
-        mode = 0
-        for a in args:
-            if mode == 0:
-                sentance+="('"+a+"' in assets.variables)"
-            elif mode == 1:
-                if a=="AND": sentance+=" and "
-                elif a=="OR": sentance+=" or "
-                else: raise script_error("Logic must be AND or OR")
-            mode = 1-mode
-        if not eval(sentance)==value: return self.fail(label,fail)
+        try:
+            found = scriptexpr.check_flags(args,assets.variables)
+        except ValueError,e:
+            raise script_error(str(e))
+        if not found==value: return self.fail(label,fail)
         self.succeed(label)
     @category([COMBINED("flag_expression","list of flag names joined with AND or OR"),
                     CHOICE([
@@ -934,11 +915,10 @@ char test
                 prop = a.split("=",1)[1]
         if not name or not prop:
             raise script_error("getprop: need to supply an object name= and a prop= to get")
-        for o in self.obs:
-            if getattr(o,"id_name",None)==name:
-                p = str(o.getprop(prop))
-                assets.variables[variable]=p
-                return
+        for o in self.world.in_render_order(self.world.named(name)):
+            p = str(o.getprop(prop))
+            assets.variables[variable]=p
+            return
         raise script_error("getprop: object not found")
     @category([VALUE("variable","The variable to save the value into"),KEYWORD("name","The object to get the property from"),KEYWORD("prop","The property to get from the object")],type="logic")
     def _setprop(self,command,*args):
@@ -956,10 +936,9 @@ char test
         val = " ".join(val)
         if not name or not prop:
             raise script_error("setprop: need to supply an object name= and a prop= to set")
-        for o in self.obs:
-            if getattr(o,"id_name",None)==name:
-                o.setprop(prop,val)
-                return
+        for o in self.world.in_render_order(self.world.named(name)):
+            o.setprop(prop,val)
+            return
         raise script_error("setprop: object not found")
     @category([VALUE("variable","variable name to save random value to"),VALUE("start","smallest number to generate"),VALUE("end","largest number to generate")],type="logic")
     def _random(self,command,variable,start,end):
@@ -1174,10 +1153,7 @@ would set 'x' to 12."""
         if label.endswith("?"):
             args.append(label[:-1])
             label = "?"
-        args = " ".join(args).split(" AND ")
-        args = [x.split(" OR ") for x in args]
-        args = [OR(x) for x in args]
-        if False in args: return self.fail(label,fail)
+        if not scriptexpr.check_conditions(" ".join(args),assets.variables): return self.fail(label,fail)
         self.succeed(label)
     @category([COMBINED('expression','An expression that evaluates to true or false'),
                     KEYWORD('fail','label to jump to if expression fails'),
@@ -1198,10 +1174,7 @@ would set 'x' to 12."""
         if label.endswith("?"):
             args.append(label[:-1])
             label = "?"
-        args = " ".join(args).split(" AND ")
-        args = [x.split(" OR ") for x in args]
-        args = [OR(x) for x in args]
-        if False in args: return self.succeed(label)
+        if not scriptexpr.check_conditions(" ".join(args),assets.variables): return self.succeed(label)
         self.fail(label,fail)
     @category([VALUE('variable',"Variable to check if it doesn't exist"),
                     CHOICE([VALUE('label','a label to jump to if the variable has not been set or is blank'),TOKEN('?','execute next line only if variable is unset or blank')])],type="logic")
@@ -2281,6 +2254,7 @@ exit}}}
         for o in self.obs:
             o.delete()
         pygame.screen.fill([0,0,0])
+        dirty.reset()
     @category([KEYWORD("name","Unique name of object to delete."),TOKEN("suppress","Don't show error message even if object cannot be found to delete")],type="objects")
     def _delete(self,command,*args):
         """Deletes the named object from the scene. (Any time you give an object a name, such as 'ev bloody_knife name=bk' you can
@@ -2293,11 +2267,10 @@ exit}}}
             if a=="suppress":
                 suppress = True
         any = False
-        for o in reversed(self.obs):
-            if getattr(o,"id_name",None)==name:
-                any = True
-                o.delete()
-                break
+        for o in reversed(self.world.in_render_order(self.world.named(name))):
+            any = True
+            o.delete()
+            break
         if not suppress and name and not any and vtrue(assets.variables.get("_debug","false")):
             print "error"
             raise missing_object("Delete: cannot find "+name)
@@ -2920,7 +2893,7 @@ def make_start_script(logo=True):
     def run_updater(*args):
         import libupdate
         reload(libupdate)
-        assets.cur_script.world.all.append(libupdate.run(pygame.screen))
+        assets.cur_script.world.append(libupdate.run(pygame.screen))
         #assets.make_start_script()
     setattr(make_start_script,"UPDATES",run_updater)
     item = ws_button(make_start_script,"UPDATES")
@@ -2985,6 +2958,9 @@ def make_start_script(logo=True):
 
 assets.make_start_script = make_start_script
             
+dirty = dirtyrects.Tracker([sw,sh*2])  #What changed on pygame.screen between frames
+layers = layercache.LayerCache(lambda below:(below or pygame.blank).copy(),
+    lambda surface,obs:[o.draw(surface) for o in obs])  #Objects on pygame.screen which stopped changing
 
 def make_screen():
     if assets.swidth<256:
@@ -2993,6 +2969,9 @@ def make_screen():
         assets.sheight = 192*assets.num_screens
     if not hasattr(assets,"cur_screen"):
         assets.cur_screen = 0
+    dirty.reset()
+    layers.reset()
+    output.reset()
     flags = pygame.RESIZABLE|pygame.FULLSCREEN*assets.fullscreen
     SCREEN=pygame.real_screen = pygame.display.set_mode([assets.swidth,assets.sheight],flags)
     ns = assets.num_screens
@@ -3027,7 +3006,7 @@ def make_screen():
         pygame.blank.fill([0,0,0])
 
 def scale_relative_click(pos,rel):
-    mode,dim = settings.screen_format(assets)
+    mode,dim = output.format()
     def col(pp,ss):
         if pos[0]>=pp[0] and pos[0]<=pp[0]+ss[0]\
             and pos[1]>=pp[1] and pos[1]<=pp[1]+ss[1]:
@@ -3045,7 +3024,7 @@ def scale_relative_click(pos,rel):
     return rel
     
 def translate_click(pos):
-    mode,dim = settings.screen_format(assets)
+    mode,dim = output.format()
     def col(pp,ss):
         if pos[0]>=pp[0] and pos[0]<=pp[0]+ss[0]\
             and pos[1]>=pp[1] and pos[1]<=pp[1]+ss[1]:
@@ -3064,34 +3043,75 @@ def translate_click(pos):
             r[1]+=sh
             return r
     return [-100000,-100000]
-def fit(surf,size):
-    if assets.smoothscale and surf.get_bitsize() in [24,32]:
-        surf = pygame.transform.smoothscale(surf,[int(x) for x in size])
-    else:
-        surf = pygame.transform.scale(surf,[int(x) for x in size])
-    return surf
-def draw_screen(showfps):
-    scale = 0
-    if assets.sheight!=sh or assets.swidth!=sw: scale = 1
-    scaled = pygame.screen
-    top = scaled.subsurface([[0,0],[sw,sh]])
-    bottom = top
-    mode,dim = settings.screen_format(assets)
+class Output(object):
+    """Where the screens go in the window and the surfaces they are scaled
+    into, only worked out again when the window or screen settings change"""
+    def __init__(self):
+        self.reset()
+    def reset(self):
+        self.key = None
+    def format(self):
+        """mode,dim as settings.screen_format gives them"""
+        key = (assets.swidth,assets.sheight,assets.num_screens,assets.screen_compress,
+            getattr(assets,"cur_screen",0),assets.smoothscale)
+        if key!=self.key:
+            self.key = key
+            self.mode,self.dim = settings.screen_format(assets)
+            self.targets = {}  #screen name:surface it is scaled into
+            self.shown = False  #Whether a whole frame has been shown with this layout
+        return self.mode,self.dim
+    def scale(self,name,surf,size):
+        """surf scaled to size, into the surface kept for the screen called name"""
+        size = [int(x) for x in size]
+        if list(surf.get_size())==size:
+            return surf
+        target = self.targets.get(name,None)
+        if not target or list(target.get_size())!=size:
+            target = self.targets[name] = pygame.Surface(size,0,surf)
+        if assets.smoothscale and surf.get_bitsize() in [24,32]:
+            pygame.transform.smoothscale(surf,size,target)
+        else:
+            pygame.transform.scale(surf,size,target)
+        return target
+output = Output()
+def draw_screen(showfps=False,rects=None):
+    """Show pygame.screen in the window. rects are the parts which changed
+    since the last frame shown, None when it may all have changed. A screen
+    with nothing changed on it isn't scaled again."""
+    mode,dim = output.format()
+    sources = {"top":[0,0,sw,sh],"bottom":[0,0,sw,sh]}
     if mode == "two_screens" or mode == "horizontal" or mode == "show_one":
-        bottom = scaled.subsurface([[0,sh],[sw,sh]])
-    pygame.real_screen.fill([10,10,10])
-    def draw_segment(dest,surf,pos,size):
-        rp = [pos[0]*assets.swidth,pos[1]*assets.sheight]
-        rs = [size[0]*assets.swidth,size[1]*assets.sheight]
-        surf = fit(surf,rs)
-        dest.blit(surf,rp)
-    if dim["top"]:
-        draw_segment(pygame.real_screen,top,dim["top"][0],dim["top"][1])
-    if dim["bottom"]:
-        draw_segment(pygame.real_screen,bottom,dim["bottom"][0],dim["bottom"][1])
+        sources["bottom"] = [0,sh,sw,sh]
+    if rects is None:
+        dirty.reset()
+    if not output.shown or showfps:
+        output.shown = True
+        rects = None
+    if rects is None:
+        pygame.real_screen.fill([10,10,10])
+    update = []
+    for name in ["top","bottom"]:
+        if not dim[name]:
+            continue
+        src = sources[name]
+        dest = dim[name][2]+dim[name][3]
+        if rects is not None:
+            changed = [r for r in [dirtyrects.scale_rect(rect,src,dest) for rect in rects] if r]
+            if not changed:
+                continue
+            update.extend(changed)
+        surf = output.scale(name,pygame.screen.subsurface(src),dest[2:])
+        pygame.real_screen.blit(surf,dest[:2])
+    reads,writes,special = Variables.take_counts()
+    cached,built = layers.take_counts()
     if showfps:
         pygame.real_screen.blit(assets.get_font("nt").render(str(clock.get_fps()),1,[100,180,200]),[0,pygame.real_screen.get_height()-12])
-    pygame.display.flip()
+        pygame.real_screen.blit(assets.get_font("nt").render("vars read %s written %s special %s"%(reads,writes,special),1,[100,180,200]),[0,pygame.real_screen.get_height()-24])
+        pygame.real_screen.blit(assets.get_font("nt").render("layers cached %s built %s"%(cached,built),1,[100,180,200]),[0,pygame.real_screen.get_height()-36])
+    if rects is None:
+        pygame.display.flip()
+    else:
+        pygame.display.update(update)
 assets.make_screen = make_screen
 assets.draw_screen = draw_screen
 
@@ -3224,16 +3244,18 @@ linecache,encodings.aliases,exceptions,sre_parse,os,goodkeys,k,core,libengine".s
                 #~ print "vvvvvvvvvvvvvvvvvvvvvvv"
                 #~ print [[x,x.pri] for x in assets.cur_script.obs]
         if not assets.cur_script: break
-        [o.unadd() for o in assets.cur_script.obs if getattr(o,"kill",0) and hasattr(o,"unadd")]
-        for o in assets.cur_script.world.all[:]:
-            if getattr(o,"kill",0):
-                assets.cur_script.world.all.remove(o)
+        assets.cur_script.world.compact()
         assets.next_screen -= assets.dt
         if assets.next_screen < 0:
-            pygame.screen.blit(pygame.blank,[0,0])
+            rects = [[0,0,sw,sh*2]]
             try:
-                assets.cur_script.draw(pygame.screen)
+                drawn = assets.cur_script.draw_dirty(pygame.screen,dirty,layers)
+                if drawn is not None:
+                    rects = drawn
             except (art_error,script_error),e:
+                pygame.screen.set_clip(None)
+                dirty.reset()
+                layers.reset()
                 assets.cur_script.obs.append(error_msg(e.value,assets.cur_script.lastline_value,assets.cur_script.si,assets.cur_script))
             if assets.flash:
                 fl = flash()
@@ -3246,8 +3268,10 @@ linecache,encodings.aliases,exceptions,sre_parse,os,goodkeys,k,core,libengine".s
             if assets.shakeargs != 0:
                 assets.cur_script._shake("shake",*assets.shakeargs)
                 assets.shakeargs = 0
-            if assets.variables.get("render",1):
-                draw_screen(assets.show_fps)
+            if not assets.variables.get("render",1):
+                dirty.reset()
+            elif rects or assets.show_fps:
+                draw_screen(assets.show_fps,rects)
             assets.next_screen = assets.screen_refresh
         #pygame.image.save(pygame.real_screen,"capture/img%.04d.jpg"%fr)
         #fr+=1
@@ -3307,6 +3331,9 @@ linecache,encodings.aliases,exceptions,sre_parse,os,goodkeys,k,core,libengine".s
                         for ob in assets.cur_script.obs:
                             if hasattr(ob,"minimized"):
                                 ob.delete()
+                        dirty.reset()
+                if e.type==pygame.VIDEOEXPOSE:
+                    dirty.reset()
                 if e.type==pygame.VIDEORESIZE:
                     w,h = e.w,e.h
                     assets.swidth = w
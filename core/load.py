@@ -52,32 +52,20 @@ def load(script,olist):
     if cls == "scroll":
         o = scroll()
         def f(o=o,props=props):
-            o.obs = []
-            for o2 in script.obs:
-                if getattr(o2,"id_name",None) in props["ob_ids"]:
-                    o.obs.append(o2)
+            o.obs = script.world.in_render_order(script.world.named(*props["ob_ids"]))
     if cls == "zoomanim":
         o = zoomanim()
         def f(o=o,props=props):
-            o.obs = []
-            for o2 in script.obs:
-                if getattr(o2,"id_name",None) in props["ob_ids"]:
-                    o.obs.append(o2)
+            o.obs = script.world.in_render_order(script.world.named(*props["ob_ids"]))
     if cls == "rotateanim":
         o = rotateanim()
         def f(o=o,props=props):
-            o.obs = []
-            for o2 in script.obs:
-                if getattr(o2,"id_name",None) in props["ob_ids"]:
-                    o.obs.append(o2)
+            o.obs = script.world.in_render_order(script.world.named(*props["ob_ids"]))
     if cls in ["fadeanim","tintanim"]:
         print cls
         o = {"fadeanim":fadeanim,"tintanim":tintanim}[cls]()
         def f(o=o,props=props):
-            o.obs = []
-            for o2 in script.obs:
-                if getattr(o2,"id_name",None) in props["ob_ids"]:
-                    o.obs.append(o2)
+            o.obs = script.world.in_render_order(script.world.named(*props["ob_ids"]))
     if cls == "textbox":
         o = textbox(*args)
     if cls == "textblock":
@@ -86,9 +74,8 @@ def load(script,olist):
         o = uglyarrow()
         if props.get("_tb",""):
             def f(o=o,props=props):
-                for tb in script.world.all:
-                    if isinstance(tb,textbox):
-                        o.textbox = tb
+                for tb in script.world.instances(textbox):
+                    o.textbox = tb
                 o.update()
     if cls == "penalty":
         o = penalty(*args)
@@ -103,9 +90,7 @@ def load(script,olist):
         o = examine_menu(props["hide"])
         o.bg = []
         def f(o=o,props=props):
-            for o2 in script.obs:
-                if getattr(o2,"id_name",None) in props["bg_ids"]:
-                    o.bg.append(o2)
+            o.bg.extend(script.world.in_render_order(script.world.named(*props["bg_ids"])))
     if cls == "guiWait":
         o = guiWait()
         o.script = script
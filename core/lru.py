@@ -0,0 +1,69 @@
+"""Least recently used cache which evicts against a size budget"""
+from collections import OrderedDict
+
+class LRUCache(object):
+    def __init__(self,budget,sizeof=lambda value:1):
+        """budget is the total size allowed, sizeof(value) measures an entry.
+        A budget of 0 disables the cache."""
+        self.budget = budget
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    def __len__(self):
+        return len(self.entries)
+    def __contains__(self,key):
+        return key in self.entries
+    def get(self,key,default=None):
+        entry = self.entries.pop(key,None)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries[key] = entry
+        return entry[0]
+    def put(self,key,value):
+        self.discard(key)
+        size = self.sizeof(value)
+        if size>self.budget:
+            return
+        self.entries[key] = [value,size]
+        self.size += size
+        self.shrink()
+    def discard(self,key):
+        entry = self.entries.pop(key,None)
+        if entry is not None:
+            self.size -= entry[1]
+    def shrink(self):
+        while self.size>self.budget and self.entries:
+            key,entry = self.entries.popitem(False)
+            self.size -= entry[1]
+            self.evictions += 1
+    def set_budget(self,budget):
+        self.budget = budget
+        self.shrink()
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+    def stats(self):
+        return {"entries":len(self.entries),"size":self.size,"budget":self.budget,
+            "hits":self.hits,"misses":self.misses,"evictions":self.evictions}
+
+def test():
+    c = LRUCache(10,len)
+    c.put("a","aaaa")
+    c.put("b","bbbb")
+    assert c.get("a")=="aaaa"
+    c.put("c","cccc")
+    assert "b" not in c and "a" in c and "c" in c
+    assert c.get("b") is None
+    c.put("d","d"*11)
+    assert "d" not in c
+    c.set_budget(4)
+    assert c.entries.keys()==["c"]
+    assert c.stats()=={"entries":1,"size":4,"budget":4,"hits":1,"misses":1,"evictions":2},c.stats()
+
+if __name__=="__main__":
+    test()
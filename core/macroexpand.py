@@ -0,0 +1,92 @@
+"""Macro definitions and expansion for script lines, in one pass over the lines.
+
+A macro body is compiled once into literal text and $parameter slots. $0 is
+the index of the output line before the macro call, $1.. are the positional
+arguments and $name the name=value arguments. As with plain string
+replacement, a parameter fills the start of a longer $word ($0_end) and
+$0 is tried first, then the positional arguments, then the named ones."""
+
+def parse_macros(lines):
+    """Alters lines to not include macro definitions, and returns macros"""
+    macros = {}
+    kept = []
+    macro = False
+    for line in lines:
+        if line.startswith("macro "):
+            macro = True
+            macroname = line[6:].strip()
+            macrolines = []
+        elif macro:
+            if line=="endmacro":
+                macro = False
+                macros[macroname] = macrolines
+            else:
+                macrolines.append(line)
+        else:
+            kept.append(line)
+    lines[:] = kept
+    return macros
+
+def compile_macro(body):
+    """[text,(word,text),(word,text)...] for the macro body lines, where
+    word is what follows a $ up to whitespace or the next $"""
+    parts = "\n".join(body).split("$")
+    template = [parts[0]]
+    for part in parts[1:]:
+        end = 0
+        while end<len(part) and not part[end].isspace():
+            end += 1
+        template.append((part[:end],part[end:]))
+    return template
+
+def fill(template,params):
+    """Text of a compiled macro, params is [(name,value)] in the order they are tried"""
+    out = [template[0]]
+    for word,text in template[1:]:
+        for name,value in params:
+            if word.startswith(name):
+                out.append(value+word[len(name):])
+                break
+        else:
+            out.append("$"+word)
+        out.append(text)
+    return "".join(out)
+
+def call_params(args,index):
+    params = [("0",str(index))]
+    kwargs = {}
+    positional = []
+    for a in args:
+        if a.count("=")==1:
+            k,v = a.split("=",1)
+            kwargs[k] = v
+        else:
+            positional.append(a)
+    for i,a in enumerate(positional):
+        params.append((str(i+1),a))
+    for k in kwargs:
+        params.append((k,kwargs[k]))
+    return params
+
+def expand(lines,macros):
+    """New list of lines with every {macro args} line replaced by the macro
+    body, itself expanded. Calls to unknown or empty macros are dropped."""
+    out = []
+    templates = {}
+    stack = [iter(lines)]
+    while stack:
+        for line in stack[-1]:
+            if not line.startswith("{"):
+                out.append(line)
+                continue
+            args = line[1:-1].split(" ")
+            if not macros.get(args[0],None):
+                continue
+            if args[0] not in templates:
+                templates[args[0]] = compile_macro(macros[args[0]])
+            text = fill(templates[args[0]],call_params(args[1:],len(out)-1))
+            stack.append(iter(text.split("\n")))
+            break
+        else:
+            stack.pop()
+    return out
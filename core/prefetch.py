@@ -0,0 +1,136 @@
+"""Loads the assets named by upcoming script lines on a worker thread"""
+import threading,Queue
+import lru
+
+class Prefetcher(object):
+    def __init__(self,resolve=None,load=None,size=64):
+        """resolve(kind,name) returns a path or None if there is nothing to load,
+        it runs on the thread calling scan. load(kind,path) decodes the file on
+        the worker thread, so it mustn't touch anything the game changes."""
+        self.resolve = resolve
+        self.load = load
+        self.ready = lru.LRUCache(size)
+        self.queue = Queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.script = None
+        self.start = self.end = 0
+        self.character = ""
+        self.hits = 0
+        self.misses = 0
+        self.loaded = 0
+    def scan(self,script,lookahead,variables={}):
+        """Queue loads for lines between script.si and script.si+lookahead
+        which haven't been scanned yet"""
+        si = script.si
+        if script is not self.script or si<self.start or si>self.end:
+            self.script = script
+            self.start = self.end = si
+        end = min(si+lookahead,len(script.scriptlines))
+        for line in script.scriptlines[self.end:end]:
+            for kind,name in self.requests(line,variables):
+                self.request(kind,name)
+        self.start = si
+        self.end = max(self.end,end)
+    def requests(self,line,variables={}):
+        """Return (kind,name) pairs for the assets a script line will use"""
+        args = line.strip().split()
+        if not args:
+            return []
+        command,args = args[0],args[1:]
+        names = [a for a in args if "=" not in a]
+        keys = dict(a.split("=",1) for a in args if "=" in a)
+        if command in ["bg","fg"] and names:
+            return [("art",command+"/"+names[0])]
+        if command=="ev" and names:
+            return [("art","ev/"+variables.get(names[0]+"_pic",names[0].replace("$","")))]
+        if command=="char" and names:
+            self.character = names[0]
+            if "hide" in names:
+                return []
+            reqs = self.emotion(keys.get("e","normal"))
+            if "be" in keys:
+                reqs.append(("art","port/%s/%s(blink)"%(self.character,keys["be"])))
+            return reqs
+        if command=="emo" and names:
+            if "name" in keys:
+                self.character = keys["name"]
+            return self.emotion(names[0])
+        if command=="sfx":
+            names = [a for a in args if not a.startswith("after=")]
+            if names:
+                return [("sound"," ".join(names))]
+        if command=="mus" and args:
+            return [("music"," ".join(args))]
+        return []
+    def emotion(self,emo):
+        if not self.character:
+            return []
+        path = "port/%s/%s"%(self.character,emo)
+        return [("art",path+"(blink)"),("art",path+"(talk)"),("art",path+"(combined)"),("art",path)]
+    def request(self,kind,name):
+        try:
+            path = self.resolve(kind,name)
+        except Exception:
+            return
+        if not path:
+            return
+        with self.lock:
+            if (kind,path) in self.pending or path in self.ready:
+                return
+            self.pending.add((kind,path))
+        self.queue.put((kind,path))
+        if not self.thread:
+            self.thread = threading.Thread(target=self.run,name="prefetch")
+            self.thread.daemon = True
+            self.thread.start()
+    def run(self):
+        while 1:
+            kind,path = self.queue.get()
+            try:
+                self.fetch(kind,path)
+            except Exception:
+                pass
+            with self.lock:
+                self.pending.discard((kind,path))
+            self.queue.task_done()
+    def fetch(self,kind,path):
+        with self.lock:
+            if path in self.ready:
+                return
+        value = self.load(kind,path)
+        if value is None:
+            return
+        with self.lock:
+            self.ready.put(path,value)
+            self.loaded += 1
+    def take(self,path):
+        """Hand over a prefetched object, counting a hit or a miss"""
+        with self.lock:
+            value = self.ready.get(path)
+            if value is None:
+                self.misses += 1
+                return
+            self.ready.discard(path)
+            self.hits += 1
+            return value
+    def clear(self):
+        """Forget what was loaded and drop the loads still waiting"""
+        while 1:
+            try:
+                kind,path = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            with self.lock:
+                self.pending.discard((kind,path))
+            self.queue.task_done()
+        with self.lock:
+            self.ready.clear()
+            self.script = None
+            self.start = self.end = 0
+            self.character = ""
+    def stats(self):
+        used = self.hits+self.misses
+        return {"hits":self.hits,"misses":self.misses,"loaded":self.loaded,
+            "hit_rate":used and float(self.hits)/used or 0.0}
@@ -1,28 +1,48 @@
-import os,zipfile,StringIO
+import os,zipfile,cStringIO,marshal,struct,threading
+import assetpack
+try:
+    from scandir import scandir  #Optional, the scandir package from PyPI. Without it folders are listed with listdir and isdir.
+except ImportError:
+    scandir = None
 
-filepaths = ["art","music","sfx","movies"]
+filepaths = ["art","music","sfx","movies","fonts"]
 ignore = ".hg"
 priority = ["png","jpg","gif","bmp","mp3","ogg"]
+index_name = "registry.idx"
+index_version = 3
 
-class File:
+folders = {}
+class File(object):
+    """A registry entry. Only the folder, which is shared by every file in it,
+    the file name and the priority are stored; the tags are worked out when used."""
+    __slots__ = ["folder","filename","priority"]
     def __init__(self,path):
-        self.path = path
-        self.filename = self.path.rsplit("/",1)[1]
-        self.pathtag = self.path
-        self.filetag = self.filename
-        self.ext = ""
-        if "." in self.filename:
-            self.pathtag = self.path.rsplit(".",1)[0]
-            self.filetag,self.ext = self.filename.rsplit(".",1)
+        folder,self.filename = path.rsplit("/",1)
+        self.folder = folders.setdefault(folder,folder)
         self.priority = 12
         if self.ext in priority:
             self.priority = priority.index(self.ext)
-        
-        self.filetag = self.filetag.lower()
-        self.pathtag = self.pathtag.lower()
-        self.pathtagext = self.pathtag+"."+self.ext
     def __repr__(self):
         return self.path
+    @property
+    def path(self):
+        return self.folder+"/"+self.filename
+    @property
+    def ext(self):
+        if "." in self.filename:
+            return self.filename.rsplit(".",1)[1]
+        return ""
+    @property
+    def filetag(self):
+        return self.filename.rsplit(".",1)[0].lower()
+    @property
+    def pathtag(self):
+        if "." in self.filename:
+            return self.path.rsplit(".",1)[0].lower()
+        return self.path.lower()
+    @property
+    def pathtagext(self):
+        return self.pathtag+"."+self.ext
             
 def testfile():
     a = File("../art/port/kristoph2/normal(talk).txt")
@@ -38,53 +58,342 @@ def testfile():
     assert b.priority<c.priority,"bpri:%s cpri:%s"%(b.priority,c.priority)
     assert c.priority<d.priority
 
+def stamp(path):
+    """Value which changes when the listing of a folder or the contents of a zip changes"""
+    st = os.stat(path)
+    if os.path.isdir(path):
+        return st.st_mtime
+    return (st.st_size,st.st_mtime)
+
+def file_stamp(path):
+    """stamp() of a file, or of the zip or pack it is stored in"""
+    for container in [".zip",assetpack.ext]:
+        if container+"/" in path:
+            return stamp(path.split(container+"/",1)[0]+container)
+    return stamp(path)
+
+def is_zip(path):
+    """Zip archives are recognized by extension and checked by their first bytes"""
+    if not path.lower().endswith(".zip") or not os.path.isfile(path):
+        return False
+    f = open(path,"rb")
+    try:
+        return f.read(4) in ["PK\x03\x04","PK\x05\x06"]
+    finally:
+        f.close()
+
+def list_dir(path):
+    """[(name,is folder)] for a folder, from one directory read when scandir is available"""
+    if scandir:
+        return [(e.name,e.is_dir()) for e in scandir(path)]
+    return [(name,os.path.isdir(path+"/"+name)) for name in os.listdir(path)]
+
+class ZipMember:
+    """Read-only file-like view of a stored (uncompressed) zip member, reading
+    straight from the archive instead of copying the member. Each member has
+    its own handle, so it stays readable when the pool closes the archive."""
+    def __init__(self,path,start,size):
+        self.fp = open(path,"rb")
+        self.start = start
+        self.size = size
+        self.pos = 0
+    def read(self,n=-1):
+        if n<0 or self.pos+n>self.size:
+            n = self.size-self.pos
+        if n<=0:
+            return ""
+        self.fp.seek(self.start+self.pos)
+        data = self.fp.read(n)
+        self.pos += len(data)
+        return data
+    def seek(self,offset,whence=0):
+        if whence==1:
+            offset += self.pos
+        elif whence==2:
+            offset += self.size
+        self.pos = max(0,offset)
+    def tell(self):
+        return self.pos
+    def close(self):
+        self.fp.close()
+
+class ZipPool:
+    """Keeps up to size zip archives open, closing the least recently used one.
+    An archive is reopened if its size or mtime changed since it was opened."""
+    def __init__(self,size=8):
+        self.size = size
+        self.archives = {}
+        self.order = []
+        self.lock = threading.RLock()
+        self.opens = 0
+        self.hits = 0
+        self.misses = 0
+    def get(self,path):
+        """Returns [zipfile,file handle,stamp,member offsets] for path"""
+        st = stamp(path)
+        self.lock.acquire()
+        try:
+            entry = self.archives.get(path,None)
+            if entry and entry[2]==st:
+                self.hits += 1
+                self.order.remove(path)
+                self.order.append(path)
+                return entry
+            self.misses += 1
+            if entry:
+                self.close(path)
+            fp = open(path,"rb")
+            try:
+                zf = zipfile.ZipFile(fp)
+            except:
+                fp.close()
+                raise
+            self.opens += 1
+            entry = self.archives[path] = [zf,fp,st,{}]
+            self.order.append(path)
+            while len(self.order)>self.size:
+                self.close(self.order[0])
+            return entry
+        finally:
+            self.lock.release()
+    def namelist(self,path):
+        return self.get(path)[0].namelist()
+    def open_member(self,path,name):
+        """File-like object for member name of the zip at path"""
+        self.lock.acquire()
+        try:
+            zf,fp,st,offsets = self.get(path)
+            info = zf.getinfo(name)
+            if info.compress_type!=zipfile.ZIP_STORED or info.flag_bits&0x1:
+                return cStringIO.StringIO(zf.read(name))
+            if name not in offsets:
+                fp.seek(info.header_offset)
+                fheader = struct.unpack(zipfile.structFileHeader,fp.read(zipfile.sizeFileHeader))
+                offsets[name] = info.header_offset+zipfile.sizeFileHeader+\
+                    fheader[zipfile._FH_FILENAME_LENGTH]+fheader[zipfile._FH_EXTRA_FIELD_LENGTH]
+            return ZipMember(path,offsets[name],info.file_size)
+        finally:
+            self.lock.release()
+    def close(self,path):
+        self.lock.acquire()
+        try:
+            zf,fp,st,offsets = self.archives.pop(path)
+            self.order.remove(path)
+            zf.close()
+            fp.close()
+        finally:
+            self.lock.release()
+    def close_all(self):
+        for path in self.order[:]:
+            self.close(path)
+    def stats(self):
+        return {"open":len(self.archives),"opens":self.opens,"hits":self.hits,"misses":self.misses}
+zip_pool = ZipPool()
+
+remembered = 4096  #Query strings kept by query_tags and by each registry's found
+def remember(cache,key,value):
+    if len(cache)>=remembered:
+        cache.clear()
+    cache[key] = value
+    return value
+
+_missing = object()
+query_tags = ({},{})
+def query_tag(thingie,ext=False):
+    """Normalized map key for a lookup, remembered for recent query strings"""
+    tags = query_tags[ext]
+    tag = tags.get(thingie,None)
+    if tag is not None:
+        return tag
+    f = File(os.path.normpath(thingie).replace("\\","/"))
+    if ext:
+        tag = f.pathtagext
+    else:
+        tag = f.pathtag
+    return remember(tags,thingie,tag)
+
 global_registry_cache = {}
 class Registry:
     def __init__(self,root=None,use_cache=True):
         self.map = {}
         self.ext_map = {}
+        self.stamps = {}
         self.use_cache = use_cache
+        self.forget()
         if root:
             self.build(root)
     def open(self,path,mode="rb"):
         if ".zip/" in path:
             normal,zip = path.split(".zip/",1)
-            zf = zipfile.ZipFile(normal+".zip")
-            return StringIO.StringIO(zf.open(zip,"r").read())
+            return zip_pool.open_member(normal+".zip",zip)
+        if assetpack.ext+"/" in path:
+            pack,name = path.split(assetpack.ext+"/",1)
+            return assetpack.get(pack+assetpack.ext).open(name)
         return open(path,mode)
+    def packed(self,path):
+        """(record,pixel buffer) for an image stored in an asset pack, otherwise None"""
+        if assetpack.ext+"/" not in path:
+            return
+        pack,name = path.split(assetpack.ext+"/",1)
+        pack = assetpack.get(pack+assetpack.ext)
+        record = pack.record(name)
+        if record and "format" in record:
+            return record,pack.data(name)
     def clear_cache(self):
         global_registry_cache.clear()
-    def build(self,root,progress_function=lambda:1):
+        folders.clear()
+        zip_pool.close_all()
+        assetpack.close_all()
+    def build(self,root,progress_function=lambda *args:1):
+        self.forget()
         if self.use_cache and root in global_registry_cache:
             self.map,self.ext_map = global_registry_cache[root]
             return
         self.root = root
-        for sub in filepaths:
-            if os.path.isdir(root+"/"+sub):
-                self.index(root+"/"+sub)
-		progress_function()
+        if self.use_cache and self.load_index(root):
+            global_registry_cache[root] = [self.map,self.ext_map]
+            return
+        self.index_all([root+"/"+sub for sub in self.index_subs(root)],progress_function)
         global_registry_cache[root] = [self.map,self.ext_map]
+        if self.use_cache:
+            self.save_index(root)
+    def index_subs(self,root):
+        return [sub for sub in filepaths if os.path.isdir(root+"/"+sub)]
+    def load_index(self,root):
+        """Restore map and ext_map from the index file in root, if none of
+        the indexed folders or zips have changed since it was written"""
+        try:
+            f = open(root+"/"+index_name,"rb")
+            try:
+                d = marshal.load(f)
+            finally:
+                f.close()
+        except Exception:
+            return False
+        if not isinstance(d,dict) or d.get("version")!=index_version or d.get("root")!=root:
+            return False
+        if d.get("subs")!=self.index_subs(root) or not isinstance(d.get("stamps"),dict):
+            return False
+        for path,value in d["stamps"].items():
+            try:
+                if stamp(path)!=value:
+                    return False
+            except (OSError,TypeError):
+                return False
+        try:
+            files = [File(path) for path in d["files"]]
+            self.map = dict([(tag,files[i]) for tag,i in d["map"].items()])
+            self.ext_map = dict([(tag,files[i]) for tag,i in d["ext_map"].items()])
+        except Exception:
+            return False
+        self.stamps = d["stamps"]
+        return True
+    def save_index(self,root):
+        """Write the index with marshal rather than pickle, as game folders are
+        downloaded and loading a pickle can run code. Files are stored once
+        as paths, the maps hold their positions in that list."""
+        files = []
+        number = {}
+        def n(file):
+            if id(file) not in number:
+                number[id(file)] = len(files)
+                files.append(file.path)
+            return number[id(file)]
+        d = {"version":index_version,"root":root,"subs":self.index_subs(root),"stamps":self.stamps,
+            "map":dict([(tag,n(f)) for tag,f in self.map.items()]),
+            "ext_map":dict([(tag,n(f)) for tag,f in self.ext_map.items()]),"files":files}
+        try:
+            f = open(root+"/"+index_name,"wb")
+            try:
+                marshal.dump(d,f)
+            finally:
+                f.close()
+        except (IOError,OSError):
+            pass
     def list_files(self,path):
         if os.path.isdir(path):
             return os.listdir(path)
-        if zipfile.is_zipfile(path):
-            return zipfile.ZipFile(path,"r").namelist()
+        if assetpack.is_pack(path):
+            return assetpack.get(path).namelist()
+        if is_zip(path):
+            return zip_pool.namelist(path)
+    def index_all(self,paths,progress_function=lambda *args:1):
+        """Scan each path on its own thread, then map the files in the same order
+        a single depth first walk would. progress_function(folders scanned,
+        folders found) is called from this thread while the scan runs."""
+        progress = [0,len(paths)]
+        lock = threading.Lock()
+        results = [None]*len(paths)
+        stamps = [{} for p in paths]  #Kept per thread and merged once they finish
+        def work(i):
+            try:
+                results[i] = self.scan(paths[i],progress,lock,stamps[i])
+            except Exception,e:
+                results[i] = e
+        threads = [threading.Thread(target=work,args=(i,),name="index") for i in range(len(paths))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        shown = None
+        for t in threads:
+            while t.isAlive():
+                t.join(0.1)
+                if progress!=shown:
+                    shown = progress[:]
+                    progress_function(*shown)
+        if progress!=shown:
+            progress_function(*progress)
+        for s in stamps:
+            self.stamps.update(s)
+        for files in results:
+            if isinstance(files,Exception):
+                raise files
+            for args in files:
+                self.mapfile(*args)
     def index(self,path):
-        in_zip = zipfile.is_zipfile(path)
+        self.index_all([path])
+    def scan(self,path,progress=None,lock=None,stamps=None):
+        """[(path,in zip,in pack)] for the files under path, depth first.
+        Stamps of the folders and archives go in stamps, or self.stamps."""
+        if stamps is None:
+            stamps = self.stamps
+        in_pack = assetpack.is_pack(path)
+        in_zip = not in_pack and is_zip(path)
+        stamps[path] = stamp(path)
+        if in_pack or in_zip:
+            entries = [(name,False) for name in self.list_files(path)]
+        else:
+            entries = list_dir(path)
+        files = []
         subdirs = []
-        for sub in self.list_files(path):
-            if sub==".hg":
+        for name,isdir in entries:
+            if name==ignore:
                 continue
-            elif os.path.isdir(path+"/"+sub) or zipfile.is_zipfile(path+"/"+sub):
-                subdirs.append(path+"/"+sub)
+            sub = path+"/"+name
+            if in_pack or in_zip:
+                files.append((sub,in_zip,in_pack))
+            elif isdir or is_zip(sub) or assetpack.is_pack(sub):
+                subdirs.append(sub)
             else:
-                self.mapfile(path+"/"+sub,in_zip)
+                files.append((sub,False,False))
+        if progress:
+            lock.acquire()
+            progress[0] += 1
+            progress[1] += len(subdirs)
+            lock.release()
         for sub in subdirs:
-            self.index(sub)
-    def mapfile(self,path,in_zip=False):
+            files.extend(self.scan(sub,progress,lock,stamps))
+        return files
+    def mapfile(self,path,in_zip=False,in_pack=False):
+        if len(self.found[0]) or len(self.found[1]):
+            self.forget()
         file = File(path)
         tag = file.pathtag.split(self.root.lower()+"/",1)[1]
-        if in_zip:
+        tagext = file.pathtagext.split(self.root.lower()+"/",1)[1]
+        if in_pack:
+            tag = tag.replace(assetpack.ext+"/","/")
+            tagext = tagext.replace(assetpack.ext+"/","/")
+        elif in_zip:
             spl = tag.split("/")
             spl[-2] = spl[-2].rsplit(".",1)[0]
             tag = "/".join(spl)
@@ -93,30 +402,59 @@ class Registry:
                 self.map[tag] = file
         else:
             self.map[tag] = file
-        tagext = file.pathtagext.split(self.root.lower()+"/",1)[1]
         if tagext in self.ext_map:
             if file.priority<=self.ext_map[tagext].priority:
                 self.ext_map[tagext] = file
         else:
             self.ext_map[tagext] = file
+    def forget(self):
+        """Drop remembered lookups, for when the maps change"""
+        self.found = ({},{})
     def lookup(self,thingie,ext=False):
-        thingie = os.path.normpath(thingie).replace("\\","/")
-        f = File(thingie)
+        found = self.found[ext]
+        path = found.get(thingie,_missing)
+        if path is _missing:
+            path = remember(found,thingie,self.lookup_tag(query_tag(thingie,ext),ext))
+        return path
+    def lookup_tag(self,tag,ext=False):
         map = self.map
-        tag = f.pathtag
         if ext:
             map = self.ext_map
-            tag = f.pathtagext
         if tag in map:
             path = map[tag].path
             if "./" in path:
                 path = path.split("./",1)[1]
             return path
+    def tags(self,ext=False):
+        if ext:
+            return self.ext_map.keys()
+        return self.map.keys()
     def override(self,other_reg):
+        self.forget()
         self.map.update(other_reg.map)
         self.ext_map.update(other_reg.ext_map)
+
+class LayeredRegistry(Registry):
+    """Looks files up in a chain of registries, the most recently added layer
+    first. The layers keep their own indexes, which are shared and never copied."""
+    def __init__(self,layers=[]):
+        Registry.__init__(self)
+        self.layers = list(layers)
+    def override(self,other_reg):
+        self.forget()
+        self.layers.append(other_reg)
+    def lookup_tag(self,tag,ext=False):
+        for layer in reversed(self.layers):
+            path = layer.lookup_tag(tag,ext)
+            if path:
+                return path
+    def tags(self,ext=False):
+        tags = set()
+        for layer in self.layers:
+            tags.update(layer.tags(ext))
+        return list(tags)
             
-def combine_registries(root,progress_function=lambda:1):
+def combine_registries(root,progress_function=lambda *args:1):
     spl = root.split("/")
     last = ""
     order = []
@@ -126,7 +464,7 @@ def combine_registries(root,progress_function=lambda:1):
         else:
             last=x
         order.append(last)
-    cur_reg = Registry()
+    cur_reg = LayeredRegistry()
     for root in order:
         print "building registry for",root
         reg = Registry()
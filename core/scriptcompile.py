@@ -0,0 +1,115 @@
+"""Script lines compiled once into command records, so running a line doesn't
+clean, split and look up its command again each time it is reached.
+
+A record keeps the cleaned text of the line, whether it is a quoted textbox
+line, and the words of the command with $variable words left as slots to be
+filled from the variables when the line runs. Labels are indexed by name so
+a jump is a bisect over that label's lines rather than a scan of them all."""
+import bisect
+
+def clean(line):
+    """Line without tabs, line ends, # and // comments or surrounding space"""
+    line = line.replace("\t","    ")
+    line = line.replace("\r","").replace("\n","")
+    line = line.rsplit("#",1)[0]
+    line = line.rsplit("//",1)[0]
+    return line.strip()
+
+class Command(object):
+    __slots__ = ["text","textbox","opcode","args","slots"]
+    def __init__(self,text):
+        self.text = text
+        self.textbox = False
+        self.opcode = None
+        self.args = []
+        self.slots = []
+        if not text:
+            return
+        if text[0] in [u'"',u'\u201C'] and len(text)>1:
+            if not (text.endswith('"') or text.endswith(u'\u201C')):
+                text = text+u'"'
+            self.textbox = True
+            self.opcode = "textbox"
+            self.args = ["textbox",text[1:-1]]
+            return
+        for i,word in enumerate(text.split(u" ")):
+            if word.startswith("$") and not word[1:2].isdigit():
+                self.slots.append((i,u"",word[1:]))
+            elif word.startswith("$"):
+                word = u""
+            elif u"=" in word:
+                key,value = word.split(u"=",1)
+                if value.startswith(u"$"):
+                    self.slots.append((i,key+u"=",value[1:]))
+            self.args.append(word)
+        if not self.slots or self.slots[0][0]:
+            self.opcode = self.args[0]
+    def resolve(self,variables):
+        """Words of the command with the slots filled in, raises KeyError
+        for an undefined variable"""
+        if not self.slots:
+            return self.args
+        args = self.args[:]
+        for i,prefix,name in self.slots:
+            if prefix:
+                args[i] = prefix+variables[name]
+            else:
+                args[i] = variables[name]
+        return args
+
+def compile_line(line):
+    return Command(clean(line))
+
+def compile_lines(lines):
+    return [compile_line(line) for line in lines]
+
+compiled = {}  #path:[lines,commands] for scripts read from files
+def compile_script(path,lines):
+    """Commands for the lines of the script at path, reused while the script
+    still has the same lines"""
+    entry = compiled.get(path,None)
+    if entry and entry[0]==lines:
+        return entry[1]
+    commands = compile_lines(lines)
+    compiled[path] = [list(lines),commands]
+    return commands
+
+def command_table(cls):
+    """command:function for each _command method of a script class"""
+    table = {}
+    for name in dir(cls):
+        if name.startswith("_") and not name.startswith("__"):
+            func = getattr(cls,name)
+            if callable(func):
+                table[name[1:]] = func
+    return table
+
+def label_index(labels):
+    """name:[(line,order)] sorted, for labels [[name,line]] in script order"""
+    index = {}
+    for order,(name,line) in enumerate(labels):
+        index.setdefault(name,[]).append((line,order))
+    for entries in index.values():
+        entries.sort()
+    return index
+
+def find_label(index,name,si,backup="none"):
+    """(label,line) to jump to: the first name label at or after si, or the
+    first backup label after si if it comes sooner, else the first name label.
+    None if there is no such label."""
+    found = []
+    entries = index.get(name,None)
+    if entries:
+        i = bisect.bisect_left(entries,(si,))
+        if i<len(entries):
+            found.append((entries[i],name))
+    backups = index.get(backup,None)
+    if backups:
+        i = bisect.bisect_left(backups,(si+1,))
+        if i<len(backups):
+            found.append((backups[i],backup))
+    if found:
+        (line,order),label = min(found)
+        return label,line
+    if entries:
+        return name,entries[0][0]
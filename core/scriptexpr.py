@@ -0,0 +1,238 @@
+"""Expressions for is_ex and set_ex, and the simpler conditions of is, isnot
+and flag, compiled once per source text into functions of the variables.
+
+An expression is reduced the way it always has been: the operator earliest
+in the ranks list binds first, leftmost first among equals, and every result
+is turned back into text before the next operator reads it.
+
+Compiled forms are kept per source text. Text with variables substituted in
+can take endless values, so each cache is emptied when it reaches limit."""
+limit = 1024
+
+def truth(text):
+    """Same as vtrue"""
+    return text.lower() in ["on","1","true"]
+
+def value(v,variables):
+    """Number for text starting with a digit, the text inside quotes, or
+    else the variable's value read the same way"""
+    if v[0].isdigit():
+        if "." in v:
+            return float(v)
+        return int(v)
+    if v.startswith("'") and v.endswith("'"):
+        return v[1:-1]
+    v = variables.get(v,"")
+    if v[0].isdigit():
+        if "." in v:
+            return float(v)
+        return int(v)
+    return v
+
+class Op(object):
+    def __init__(self,word,apply,logic=False):
+        """apply(left,right) gets the values of both sides, or for a logic
+        operator whether each side is true"""
+        self.word = word
+        self.apply = apply
+        self.logic = logic
+        self.rank = 0
+
+def boolean(x):
+    return str(x).lower()
+def logic(x):
+    if x:
+        return "true"
+    return "false"
+
+ranks = [Op("*",lambda a,b:a*b),Op("/",lambda a,b:a/b),
+    Op("+",lambda a,b:a+b),Op("-",lambda a,b:a-b),
+    Op("==",lambda a,b:boolean(a==b)),Op("<",lambda a,b:boolean(a<b)),
+    Op(">",lambda a,b:boolean(a>b)),Op("<=",lambda a,b:boolean(a<=b)),
+    Op(">=",lambda a,b:boolean(a>=b)),Op("OR",lambda a,b:logic(a or b),True),
+    Op("AND",lambda a,b:logic(a and b),True)]
+operators = {}
+for rank,op in enumerate(ranks):
+    op.rank = rank
+    operators[op.word] = op
+del rank,op
+
+def tokenize(line):
+    """Operands, Ops and lists for parenthesized parts"""
+    statements = []
+    paren = []
+    quote = []
+    for word in line.split(" "):
+        if not paren and not quote and word in operators:
+            statements.append(operators[word])
+        elif word.strip():
+            if paren:
+                paren.append(word)
+                if word.endswith(")"):
+                    statements.append(tokenize(" ".join(paren)[1:-1]))
+                    paren = []
+            elif quote:
+                quote.append(word)
+                if word.endswith("'"):
+                    statements.append(" ".join(quote))
+                    quote = []
+            elif word.startswith("(") and word.endswith(")"):
+                statements.append(word[1:-1])
+            elif word.startswith("("):
+                paren.append(word)
+            elif word.startswith("'") and word.endswith("'"):
+                statements.append(word)
+            elif word.startswith("'"):
+                quote.append(word)
+            else:
+                statements.append(word)
+    return statements
+
+def constant(text):
+    node = lambda variables:text
+    node.text = text
+    return node
+
+def operand(node):
+    """Function giving the value of node, worked out now for a literal"""
+    text = getattr(node,"text",None)
+    if text and (text[0].isdigit() or (text.startswith("'") and text.endswith("'"))):
+        v = value(text,None)
+        return lambda variables:v
+    return lambda variables:value(node(variables),variables)
+
+def binary(op,left,right):
+    apply = op.apply
+    if op.logic:
+        return lambda variables:str(apply(truth(left(variables)),truth(right(variables))))
+    left = operand(left)
+    right = operand(right)
+    return lambda variables:str(apply(left(variables),right(variables)))
+
+def build(expr):
+    """Function of the variables giving the text expr reduces to"""
+    if callable(expr):
+        return expr
+    if not isinstance(expr,list):
+        return constant(str(expr))
+    if len(expr)==1:
+        return build(expr[0])
+    ops = [(v.rank,i) for i,v in enumerate(expr) if isinstance(v,Op)]
+    if not ops:
+        #The first operand is the result, but parts already reduced are still
+        #worked out so they fail as they used to
+        first = expr[0]
+        if isinstance(first,list):
+            first = constant(str(first))
+        first = build(first)
+        rest = [x for x in expr[1:] if callable(x)]
+        if not rest:
+            return first
+        def node(variables):
+            for x in rest:
+                x(variables)
+            return first(variables)
+        return node
+    rank,i = min(ops)
+    node = binary(ranks[rank],build(expr[i-1:i]),build(expr[i+1:i+2]))
+    expr = expr[:]
+    expr[i-1] = node
+    del expr[i]
+    del expr[i]
+    return build(expr)
+
+def remember(cache,key,value):
+    if len(cache)>=limit:
+        cache.clear()
+    cache[key] = value
+    return value
+
+expressions = {}  #source:compiled expression
+def compile_expression(line):
+    node = expressions.get(line,None)
+    if node is None:
+        node = remember(expressions,line,build(tokenize(line)))
+    return node
+
+def number(n):
+    """Same as INT"""
+    try:
+        return int(n)
+    except:
+        return float(n)
+
+compares = {"<":lambda a,b:a<b,">":lambda a,b:a>b,"==":lambda a,b:a==b,
+    "!=":lambda a,b:a!=b,"<=":lambda a,b:a<=b,">=":lambda a,b:a>=b}
+def build_condition(text):
+    """'name' is true when the variable is, 'name value' when it equals value,
+    and 'name op value' compares, as numbers unless op is = or !="""
+    stuff = text.split(" ",2)
+    if len(stuff)==1:
+        name = stuff[0]
+        return lambda variables:truth(variables.get(name,""))
+    if len(stuff)==2:
+        stuff = stuff[0],"=",stuff[1]
+    name,op,check = stuff
+    if op not in ["<",">","=","!=","<=",">="]:
+        check = op+" "+check
+        op = "="
+    if op=="=":
+        op = "=="
+    compare = compares[op]
+    if op in ["==","!="]:
+        return lambda variables:compare(variables.get(name),check)
+    try:
+        check = number(check)
+    except ValueError:
+        return lambda variables:compare(number(variables.get(name)),number(check))
+    return lambda variables:compare(number(variables.get(name)),check)
+
+conditions = {}  #source:[[condition,...],...]
+def compile_conditions(text):
+    """Conditions of text joined by " AND ", each a list of alternatives joined by " OR " """
+    groups = conditions.get(text,None)
+    if groups is None:
+        groups = remember(conditions,text,
+            [[build_condition(x) for x in group.split(" OR ")] for group in text.split(" AND ")])
+    return groups
+
+def check_conditions(text,variables):
+    """True if one alternative of every condition holds. Every condition is
+    checked, as before, so a bad one fails even after a false one."""
+    result = True
+    for group in compile_conditions(text):
+        for c in group:
+            if c(variables):
+                break
+        else:
+            result = False
+    return result
+
+flag_sets = {}  #flag words:[[flag,...],...]
+def compile_flags(words):
+    """Flags named in words joined with AND and OR, as groups of flags which
+    must all be set, AND binding tighter than OR"""
+    words = tuple(words)
+    groups = flag_sets.get(words,None)
+    if groups is None:
+        groups = [[]]
+        for i,word in enumerate(words):
+            if i%2==0:
+                groups[-1].append(word)
+            elif word=="OR":
+                groups.append([])
+            elif word!="AND":
+                raise ValueError("Logic must be AND or OR")
+        if not words or len(words)%2==0:
+            raise ValueError("Flag expression must name a flag after each AND or OR")
+        remember(flag_sets,words,groups)
+    return groups
+
+def check_flags(words,variables):
+    for group in compile_flags(words):
+        for flag in group:
+            if flag not in variables:
+                break
+        else:
+            return True
+    return False
@@ -23,12 +23,14 @@ screen_compress=%s
 autosave=%s
 autosave_interval=%s
 autosave_keep=%s
+art_cache_mb=%s
+preparse_meta=%s
 tool_path=%s"""%(assets.swidth,assets.sheight,assets.filter,assets.smoothscale,
 assets.fullscreen,assets.num_screens,
 int(assets.show_fps),
 assets.sound_format,assets.sound_bits,assets.sound_buffer,int(assets.sound_volume),int(assets.music_volume),
 int(assets.screen_compress),int(assets.autosave),int(assets.autosave_interval),int(assets.autosave_keep),
-assets.tool_path))
+int(assets.art_cache_mb),int(assets.preparse_meta),assets.tool_path))
     f.close()
     
 def load(assets):
@@ -43,6 +45,8 @@ def load(assets):
     assets.autosave_keep = 2 #how many saves to keep
     assets.show_fps = 0
     assets.smoothscale = 0
+    assets.art_cache_mb = 32
+    assets.preparse_meta = 0
     if os.path.exists("display.ini"):
         f = open("display.ini")
         t = f.read()
@@ -59,7 +63,8 @@ def load(assets):
                 "autosave_keep":"autosave_keep", 
                 "sound_format":"sound_format","sound_bits":"sound_bits",
                 "sound_buffer":"sound_buffer","show_fps":"show_fps",
-                "smoothscale":"smoothscale"}
+                "smoothscale":"smoothscale","art_cache_mb":"art_cache_mb",
+                "preparse_meta":"preparse_meta"}
         fl_val = {"sound_volume":"sound_volume","music_volume":"music_volume"
                 }
         s_val = {"tool_path":"tool_path"}
@@ -0,0 +1,58 @@
+'''
+Tests packing images with tools/build_pack.py.
+'''
+import unittest
+import os,sys,tempfile,shutil
+
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","..","tools"))
+
+def keyed(size,key=[255,0,255]):
+    """Opaque red image with its top left pixel in the colorkey"""
+    surf = pygame.Surface(size,0,24)
+    surf.fill([255,0,0])
+    surf.set_at([0,0],key)
+    surf.set_colorkey(key)
+    return surf
+
+@unittest.skipIf(pygame is None,"needs pygame")
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        global build_pack,assetpack
+        import build_pack
+        from core import assetpack
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir,"art"+assetpack.ext)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def alpha(self,pack,name,x,y):
+        r = pack.record(name)
+        size = r.get("page_size",(r["width"],r["height"]))
+        surf = pygame.image.frombuffer(str(pack.data(name)),size,r["format"])
+        if "page" in r:
+            surf = surf.subsurface(r["rect"])
+        return surf.get_at([x,y])[3]
+
+    def testColorkey(self):
+        pack = assetpack.PackWriter(self.path)
+        build_pack.add_image(pack,"plain.png",keyed([4,4]))
+        build_pack.add_atlas(pack,[("frame.png",keyed([8,2]),None)])
+        pack.close()
+        pack = assetpack.Pack(self.path)
+        try:
+            for name in ["plain.png","frame.png"]:
+                self.assertEqual(pack.record(name)["format"],"RGBA")
+                self.assertEqual(self.alpha(pack,name,0,0),0)
+                self.assertEqual(self.alpha(pack,name,1,1),255)
+        finally:
+            pack.close()
+
+if __name__ == "__main__":
+    unittest.main()
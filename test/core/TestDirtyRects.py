@@ -0,0 +1,78 @@
+'''
+Tests finding the parts of the screen to draw again from what objects report.
+'''
+import unittest
+import random
+
+from core import dirtyrects
+
+def covered(rects,x,y):
+    for r in rects:
+        if r[0]<=x<r[0]+r[2] and r[1]<=y<r[1]+r[3]:
+            return True
+    return False
+
+class Test(unittest.TestCase):
+
+    def testRects(self):
+        self.assertEqual(dirtyrects.union([0,0,10,10],[5,20,10,5]),[0,0,15,25])
+        self.assertTrue(dirtyrects.overlaps([0,0,10,10],[9,9,5,5]))
+        self.assertFalse(dirtyrects.overlaps([0,0,10,10],[10,0,5,5]))
+        self.assertEqual(dirtyrects.clip([-5,-5,10,10],[0,0,256,384]),[0,0,5,5])
+        self.assertEqual(dirtyrects.clip([300,0,10,10],[0,0,256,384]),None)
+        self.assertEqual(dirtyrects.merge([[0,0,10,10],[20,0,10,10],[5,5,20,2]]),[[0,0,30,10]])
+        self.assertEqual(dirtyrects.scale_rect([10,200,10,10],[0,0,256,192],[0,0,512,384]),None)
+        self.assertEqual(dirtyrects.scale_rect([10,200,10,10],[0,192,256,192],[100,384,512,384]),
+            [118,398,24,24])
+
+    def testFrames(self):
+        t = dirtyrects.Tracker([256,384])
+        bg = ("bg",[0,0,256,192],"court")
+        char = ("char",[80,40,96,152],"normal 0")
+        self.assertEqual(t.frame([bg,char]),None)
+        self.assertEqual(t.frame([bg,char]),[])
+        self.assertEqual(t.frame([bg,("char",[80,40,96,152],"normal 1")]),[[80,40,96,152]])
+        self.assertEqual(t.frame([bg,("char",[90,40,96,152],"normal 1")]),[[80,40,106,152]])
+        self.assertEqual(t.frame([bg]),[[90,40,96,152]])
+        #Drawn again every frame
+        self.assertEqual(t.frame([bg,("text",[0,130,256,62],None)]),[[0,130,256,62]])
+        self.assertEqual(t.frame([bg,("text",[0,130,256,62],None)]),[[0,130,256,62]])
+        #Something which could draw anywhere, this frame and the next are drawn in full
+        self.assertEqual(t.frame([bg,("flash",None,None)]),None)
+        self.assertEqual(t.frame([bg]),None)
+        self.assertEqual(t.frame([bg]),[])
+        self.assertEqual(t.frame([("bg",[0,0,256,192],"lobby")]),[[0,0,256,192]])
+        self.assertEqual(t.frame([("bg",[0,0,256,384],"menu")]),None)
+        t.reset()
+        self.assertEqual(t.frame([bg]),None)
+
+    def testCovers(self):
+        """Every changed pixel is in a rect to draw again"""
+        r = random.Random(2)
+        t = dirtyrects.Tracker([256,384])
+        last = {}
+        t.frame([])
+        for n in range(300):
+            regions = {}
+            for key in range(r.randrange(12)):
+                if key in last and r.random()<0.7:
+                    regions[key] = last[key]
+                else:
+                    regions[key] = ([r.randrange(-20,250),r.randrange(-20,380),r.randrange(40),r.randrange(40)],
+                        r.choice([None,1,2]))
+            rects = t.frame([(k,v[0],v[1]) for k,v in regions.items()])
+            if rects is None:
+                last = regions
+                continue
+            for key in set(regions)|set(last):
+                new,old = regions.get(key,None),last.get(key,None)
+                if new==old and new[1] is not None:
+                    continue
+                for rect,state in [x for x in [new,old] if x]:
+                    for x in range(max(rect[0],0),min(rect[0]+rect[2],256)):
+                        for y in range(max(rect[1],0),min(rect[1]+rect[3],384)):
+                            self.assertTrue(covered(rects,x,y))
+            last = regions
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+'''
+Tests the size budgeted LRU cache.
+'''
+import unittest
+
+from core import lru
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = lru.LRUCache(10,len)
+
+    def testLeastRecentlyUsedEvicted(self):
+        self.cache.put("a","aaaa")
+        self.cache.put("b","bbbb")
+        self.cache.get("a")
+        self.cache.put("c","cccc")
+        self.assertTrue("a" in self.cache and "c" in self.cache)
+        self.assertFalse("b" in self.cache)
+        self.assertEqual(self.cache.size,8)
+
+    def testOversizedSkipped(self):
+        self.cache.put("a","a"*11)
+        self.assertEqual(len(self.cache),0)
+
+    def testReplaceKeepsSize(self):
+        self.cache.put("a","aaaa")
+        self.cache.put("a","aa")
+        self.assertEqual(self.cache.size,2)
+
+    def testShrinkBudget(self):
+        self.cache.put("a","aaaa")
+        self.cache.put("b","bbbb")
+        self.cache.set_budget(4)
+        self.assertEqual(self.cache.entries.keys(),["b"])
+        self.assertEqual(self.cache.evictions,1)
+
+    def testStats(self):
+        self.cache.put("a","aaaa")
+        self.cache.get("a")
+        self.cache.get("b")
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"],stats["misses"],stats["size"]),(1,1,4))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+'''
+Tests flattening objects which stopped changing into composites per layer.
+'''
+import unittest
+
+from core import layercache
+
+class Ob(object):
+    def __init__(self,name,z,rect,state=1):
+        self.name = name
+        self.z = z
+        self.rect = rect
+        self.state = state
+    def region(self):
+        return (self,self.rect,self.state)
+
+def new(below):
+    """A surface is the list of names drawn on it"""
+    return list(below or [])
+def draw(surface,obs):
+    surface.extend([o.name for o in obs])
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = layercache.LayerCache(new,draw)
+        self.cache.settle = 2
+        self.bg = Ob("bg",1,[0,0,256,192])
+        self.port = Ob("port",2,[80,40,96,152])
+        self.fg = Ob("fg",3,[0,100,256,92])
+        self.arrow = Ob("arrow",0,[0,192,256,192])
+        self.text = Ob("text",4,[0,130,256,62],None)
+
+    def frame(self,obs):
+        base,rest = self.cache.composite([o.region() for o in obs])
+        return base,[ob.name for ob,rect,state in rest]
+
+    def testSettle(self):
+        obs = [self.bg,self.port,self.fg,self.text]
+        self.assertEqual(self.frame(obs),(None,["bg","port","fg","text"]))
+        self.assertEqual(self.frame(obs),(None,["bg","port","fg","text"]))
+        self.assertEqual(self.frame(obs),(["bg","port","fg"],["text"]))
+        self.assertEqual(self.frame(obs),(["bg","port","fg"],["text"]))
+        self.assertEqual(self.cache.take_counts(),(1,1))
+        self.assertEqual(self.cache.take_counts(),(0,0))
+        #A blink builds again from the portrait's layer only
+        layers = self.cache.layers[:]
+        self.port.state = 2
+        self.assertEqual(self.frame(obs),(["bg"],["port","fg","text"]))
+        self.assertTrue(self.cache.layers[0] is layers[0])
+        self.frame(obs)
+        self.assertEqual(self.frame(obs),(["bg","port","fg"],["text"]))
+        self.assertTrue(self.cache.layers[0] is layers[0])
+        self.assertFalse(self.cache.layers[1] is layers[1])
+
+    def testOverlap(self):
+        """Something still changing keeps what it overlaps over it"""
+        obs = [self.arrow,self.bg,self.port,self.fg,self.text]
+        for i in range(3):
+            self.frame(obs)
+        self.assertEqual(self.frame(obs),(["arrow","bg","port","fg"],["text"]))
+        self.port.state = 2
+        for i in range(3):
+            self.arrow.state = i+2
+            self.assertEqual(self.frame(obs)[1][:1],["arrow"])
+        self.assertEqual(self.frame(obs),(["bg","port","fg"],["arrow","text"]))
+        #Something that could draw anywhere stops anything after it being flattened
+        self.assertEqual(self.frame([self.bg,Ob("flash",9,None,None),self.fg]),(["bg"],["flash","fg"]))
+
+    def testReset(self):
+        obs = [self.bg]
+        for i in range(3):
+            self.frame(obs)
+        self.assertEqual(self.frame(obs),(["bg"],[]))
+        self.cache.reset()
+        self.assertEqual(self.frame(obs),(None,["bg"]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+'''
+Tests macro definitions and expansion against the in place editing they replaced.
+'''
+import unittest
+import os
+import copy
+
+from core import macroexpand
+
+def old_parse_macros(lines):
+    macros = {}
+    mode = "normal"
+    i = 0
+    while i<len(lines):
+        line = lines[i]
+        if line.startswith("macro "):
+            del lines[i]
+            i -= 1
+            mode = "macro"
+            macroname = line[6:].strip()
+            macrolines = []
+        elif mode == "macro":
+            del lines[i]
+            i -= 1
+            if line=="endmacro":
+                mode = "normal"
+                macros[macroname] = macrolines
+            else:
+                macrolines.append(line)
+        i+=1
+    return macros
+
+def old_replace_macros(lines,macros):
+    i = 0
+    while i<len(lines):
+        line = lines[i]
+        if line.startswith("{"):
+            del lines[i]
+            i -= 1
+            args = line[1:-1].split(" ")
+            if macros.get(args[0],None):
+                newlines = "\n".join(macros[args[0]])
+                args = args[1:]
+                kwargs = {}
+                for a in args[:]:
+                    if a.count("=")==1:
+                        args.remove(a)
+                        k,v = a.split("=",1)
+                        kwargs[k] = v
+                newlines = newlines.replace("$0",str(i))
+                for i2 in range(len(args)):
+                    newlines = newlines.replace("$%s"%(i2+1),args[i2])
+                for k in kwargs:
+                    newlines = newlines.replace("$%s"%k,kwargs[k])
+                newlines = newlines.split("\n")
+                for l in reversed(newlines):
+                    lines.insert(i+1,l)
+        i += 1
+
+def read_lines(path):
+    f = open(path,"rU")
+    text = f.read().decode("utf8","ignore").replace(u'\ufeff',u'')
+    f.close()
+    return text.split("\n")
+
+def library():
+    macros = {}
+    for f in sorted(os.listdir("core/macros")):
+        if f.endswith(".mcro"):
+            macros.update(old_parse_macros(read_lines("core/macros/"+f)))
+    return macros
+
+class Test(unittest.TestCase):
+
+    def testParse(self):
+        lines = ["a","macro m","x $1","endmacro","b","macro empty","endmacro"]
+        self.assertEqual(macroexpand.parse_macros(lines),{"m":["x $1"],"empty":[]})
+        self.assertEqual(lines,["a","b"])
+
+    def testExpand(self):
+        macros = {"m":["x $1 $2 $name","{inner $1}","$0_end $10"],"inner":["in $1"],"empty":[]}
+        lines = ["a","{m one two name=n}","{empty}","{unknown}","b"]
+        self.assertEqual(macroexpand.expand(lines,macros),
+            ["a","x one two n","in one","0_end one0","b"])
+
+    def testParseLikeBefore(self):
+        for f in os.listdir("core/macros"):
+            if f.endswith(".mcro"):
+                a = read_lines("core/macros/"+f)
+                b = a[:]
+                self.assertEqual(macroexpand.parse_macros(a),old_parse_macros(b),f)
+                self.assertEqual(a,b,f)
+
+    def testExpandLikeBefore(self):
+        """Every bundled script expands the same as with the old replace_macros."""
+        lib = library()
+        count = 0
+        for folder in ["core/macros","examples","games"]:
+            for root,dirs,files in os.walk(folder):
+                for f in files:
+                    if not (f.endswith(".txt") or f.endswith(".mcro")):
+                        continue
+                    lines = [l.strip() for l in read_lines(root+"/"+f)]
+                    macros = copy.copy(lib)
+                    macros.update(macroexpand.parse_macros(lines))
+                    old = lines[:]
+                    old_replace_macros(old,macros)
+                    self.assertEqual(macroexpand.expand(lines,macros),old,root+"/"+f)
+                    count += 1
+        self.assertTrue(count>50)
+
+if __name__ == "__main__":
+    unittest.main()
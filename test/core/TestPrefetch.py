@@ -0,0 +1,86 @@
+'''
+Tests the script lookahead prefetcher.
+'''
+import unittest
+import threading
+
+from core import prefetch
+
+class FakeScript(object):
+    def __init__(self,lines):
+        self.scriptlines = lines
+        self.si = 0
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.loads = []
+        self.resolved_on = []
+        self.prefetcher = prefetch.Prefetcher(self.resolve,self.load)
+
+    def resolve(self,kind,name):
+        self.resolved_on.append(threading.current_thread())
+        if "missing" in name:
+            return None
+        return kind+":"+name
+
+    def load(self,kind,path):
+        self.loads.append(path)
+        return "decoded "+path
+
+    def wait(self):
+        self.prefetcher.queue.join()
+
+    def testRequests(self):
+        req = self.prefetcher.requests
+        self.assertEqual(req("bg court stack"),[("art","bg/court")])
+        self.assertEqual(req("ev knife x=10",{"knife_pic":"knife2"}),[("art","ev/knife2")])
+        self.assertEqual(req("sfx after=4 slam.ogg"),[("sound","slam.ogg")])
+        self.assertEqual(req("mus turnabout sisters"),[("music","turnabout sisters")])
+        self.assertEqual(req("emo mad"),[])
+        self.assertEqual(req("char maya e=mad")[0],("art","port/maya/mad(blink)"))
+        self.assertEqual(req("emo happy")[-1],("art","port/maya/happy"))
+        self.assertEqual(req("char phoenix hide"),[])
+        self.assertEqual(req('"Some text"'),[])
+
+    def testScanWindow(self):
+        script = FakeScript(["bg a","bg b","bg c","bg d"])
+        self.prefetcher.scan(script,2)
+        self.wait()
+        self.assertEqual(sorted(self.loads),["art:bg/a","art:bg/b"])
+        script.si = 1
+        self.prefetcher.scan(script,2)
+        self.wait()
+        self.assertEqual(sorted(self.loads),["art:bg/a","art:bg/b","art:bg/c"])
+
+    def testHitRate(self):
+        self.prefetcher.scan(FakeScript(["bg a","bg missing"]),10)
+        self.wait()
+        self.assertEqual(self.prefetcher.take("art:bg/a"),"decoded art:bg/a")
+        self.assertEqual(self.prefetcher.take("art:bg/a"),None)
+        stats = self.prefetcher.stats()
+        self.assertEqual((stats["hits"],stats["misses"],stats["loaded"]),(1,1,1))
+        self.assertEqual(stats["hit_rate"],0.5)
+
+    def testResolveOnCaller(self):
+        self.prefetcher.scan(FakeScript(["bg a","bg b","bg missing"]),10)
+        self.wait()
+        self.assertEqual(self.resolved_on,[threading.current_thread()]*3)
+        self.assertEqual(sorted(self.loads),["art:bg/a","art:bg/b"])
+
+    def testClearDrains(self):
+        go = threading.Event()
+        def load(kind,path):
+            go.wait()
+            self.loads.append(path)
+            return path
+        self.prefetcher.load = load
+        self.prefetcher.scan(FakeScript(["bg a","bg b","bg c"]),10)
+        self.prefetcher.clear()
+        go.set()
+        self.wait()
+        self.assertTrue(len(self.loads)<=1)
+        self.assertEqual(self.prefetcher.pending,set())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,279 @@
+'''
+Tests the asset registry.
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+from core import registry
+from core import assetpack
+
+def touch(path,data=""):
+    d = os.path.dirname(path)
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    f = open(path,"wb")
+    f.write(data)
+    f.close()
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp().replace("\\","/")
+        touch(self.root+"/art/bg/court.png")
+        touch(self.root+"/art/bg/court.txt")
+        touch(self.root+"/music/theme.ogg")
+        os.makedirs(self.root+"/art/port")
+        zf = zipfile.ZipFile(self.root+"/art/port/maya.zip","w")
+        zf.writestr("normal(blink).png","png")
+        zf.close()
+        registry.global_registry_cache.clear()
+
+    def tearDown(self):
+        registry.global_registry_cache.clear()
+        shutil.rmtree(self.root)
+
+    def testIndexWritten(self):
+        """Building a registry stores an index file next to the game."""
+        reg = registry.Registry(self.root)
+        self.assertTrue(os.path.exists(self.root+"/"+registry.index_name))
+        self.assertEqual(reg.lookup("art/bg/court"),self.root+"/art/bg/court.png")
+
+    def testWarmStartUsesIndex(self):
+        """A valid index is loaded without walking the tree."""
+        registry.Registry(self.root)
+        registry.global_registry_cache.clear()
+        reg = registry.Registry(self.root,use_cache=False)
+        reg.use_cache = True
+        walked = []
+        reg.scan = lambda path,*args: walked.append(path) or []
+        reg.build(self.root)
+        self.assertEqual(walked,[])
+        self.assertEqual(reg.lookup("art/port/maya/normal(blink)"),self.root+"/art/port/maya.zip/normal(blink).png")
+        self.assertEqual(reg.lookup("music/theme.ogg",True),self.root+"/music/theme.ogg")
+
+    def testStaleIndexRebuilt(self):
+        """Adding a file changes the folder mtime and invalidates the index."""
+        registry.Registry(self.root)
+        registry.global_registry_cache.clear()
+        touch(self.root+"/art/bg/lobby.png")
+        later = time.time()+10
+        os.utime(self.root+"/art/bg",(later,later))
+        reg = registry.Registry(self.root)
+        self.assertEqual(reg.lookup("art/bg/lobby"),self.root+"/art/bg/lobby.png")
+
+    def testChangedZipRebuilt(self):
+        """Rewriting a zip with a different size invalidates the index."""
+        registry.Registry(self.root)
+        registry.global_registry_cache.clear()
+        zf = zipfile.ZipFile(self.root+"/art/port/maya.zip","a")
+        zf.writestr("angry(blink).png","png")
+        zf.close()
+        reg = registry.Registry(self.root)
+        self.assertEqual(reg.lookup("art/port/maya/angry(blink)"),self.root+"/art/port/maya.zip/angry(blink).png")
+
+    def testProgress(self):
+        """Progress is reported as folders scanned out of folders found."""
+        calls = []
+        registry.Registry(self.root,use_cache=False).build(self.root,lambda *args: calls.append(args))
+        self.assertEqual(calls[-1],(5,5))
+
+    def testZipNeedsMagic(self):
+        """A file named .zip which isn't a zip archive is indexed as a file."""
+        touch(self.root+"/art/bg/fake.zip","not a zip")
+        reg = registry.Registry(self.root,use_cache=False)
+        self.assertEqual(reg.lookup("art/bg/fake.zip",True),self.root+"/art/bg/fake.zip")
+        self.assertFalse(registry.is_zip(self.root+"/art/bg/fake.zip"))
+        self.assertTrue(registry.is_zip(self.root+"/art/port/maya.zip"))
+
+    def testFileStamp(self):
+        """Members of a zip share the zip's stamp."""
+        zip = self.root+"/art/port/maya.zip"
+        self.assertEqual(registry.file_stamp(zip+"/normal(blink).png"),registry.stamp(zip))
+        self.assertEqual(registry.file_stamp(self.root+"/art/bg/court.txt"),registry.stamp(self.root+"/art/bg/court.txt"))
+
+    def testCorruptIndexIgnored(self):
+        touch(self.root+"/"+registry.index_name,"not a pickle")
+        reg = registry.Registry(self.root)
+        self.assertEqual(reg.lookup("art/bg/court"),self.root+"/art/bg/court.png")
+
+class TestLayered(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp().replace("\\","/")
+        touch(self.root+"/art/bg/court.png")
+        touch(self.root+"/art/bg/lobby.png")
+        touch(self.root+"/case/art/bg/court.jpg")
+        touch(self.root+"/case/art/bg/court.txt")
+        registry.global_registry_cache.clear()
+
+    def tearDown(self):
+        registry.global_registry_cache.clear()
+        shutil.rmtree(self.root)
+
+    def testCaseFirst(self):
+        """The case layer hides the same file in the root layer."""
+        base = registry.Registry(self.root)
+        case = registry.Registry(self.root+"/case")
+        reg = registry.LayeredRegistry([base])
+        reg.override(case)
+        self.assertEqual(reg.lookup("art/bg/court"),self.root+"/case/art/bg/court.jpg")
+        self.assertEqual(reg.lookup("art/bg/lobby"),self.root+"/art/bg/lobby.png")
+        self.assertEqual(reg.lookup("art/bg/court.txt",True),self.root+"/case/art/bg/court.txt")
+        self.assertEqual(reg.lookup("art/bg/missing"),None)
+        self.assertEqual(sorted(reg.tags(True)),["art/bg/court.jpg","art/bg/court.png","art/bg/court.txt","art/bg/lobby.png"])
+
+    def testLayersShared(self):
+        """Layers built for the same root share one index."""
+        a = registry.Registry(self.root)
+        b = registry.Registry(self.root)
+        self.assertTrue(a.map is b.map)
+
+    def testLookupsBounded(self):
+        """Remembered lookups are capped, missing files included."""
+        reg = registry.Registry(self.root)
+        for i in range(registry.remembered+10):
+            self.assertEqual(reg.lookup("art/bg/missing%s"%i),None)
+        self.assertTrue(len(reg.found[0])<=registry.remembered)
+        self.assertTrue(len(registry.query_tags[0])<=registry.remembered)
+        self.assertEqual(reg.lookup("art/bg/lobby"),self.root+"/art/bg/lobby.png")
+        self.assertEqual(reg.lookup("art/bg/lobby"),self.root+"/art/bg/lobby.png")
+
+class TestZipPool(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp().replace("\\","/")
+        self.pool = registry.ZipPool(size=2)
+        for name in ["a","b","c"]:
+            zf = zipfile.ZipFile(self.root+"/"+name+".zip","w")
+            zf.writestr(zipfile.ZipInfo("stored.txt"),"stored "+name)
+            info = zipfile.ZipInfo("deflated.txt")
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info,"deflated "+name*100)
+            zf.close()
+
+    def tearDown(self):
+        self.pool.close_all()
+        shutil.rmtree(self.root)
+
+    def testMemberReads(self):
+        f = self.pool.open_member(self.root+"/a.zip","stored.txt")
+        self.assertEqual(f.read(3),"sto")
+        self.assertEqual(f.tell(),3)
+        f.seek(0)
+        self.assertEqual(f.read(),"stored a")
+        self.assertEqual(f.read(),"")
+        f.seek(-1,2)
+        self.assertEqual(f.read(),"a")
+        f = self.pool.open_member(self.root+"/a.zip","deflated.txt")
+        self.assertEqual(f.read(),"deflated "+"a"*100)
+
+    def testMemberOutlivesArchive(self):
+        """A member handed out can still be read after its archive is closed"""
+        f = self.pool.open_member(self.root+"/a.zip","stored.txt")
+        self.pool.get(self.root+"/b.zip")
+        self.pool.get(self.root+"/c.zip")
+        self.assertFalse(self.root+"/a.zip" in self.pool.archives)
+        self.assertEqual(f.read(),"stored a")
+        f.close()
+
+    def testHitsAndMisses(self):
+        self.pool.open_member(self.root+"/a.zip","stored.txt")
+        self.pool.open_member(self.root+"/a.zip","deflated.txt")
+        self.pool.open_member(self.root+"/a.zip","stored.txt")
+        self.assertEqual(self.pool.stats(),{"open":1,"opens":1,"hits":2,"misses":1})
+
+    def testLeastRecentlyUsedClosed(self):
+        self.pool.get(self.root+"/a.zip")
+        self.pool.get(self.root+"/b.zip")
+        self.pool.get(self.root+"/a.zip")
+        self.pool.get(self.root+"/c.zip")
+        self.assertEqual(sorted(self.pool.archives.keys()),[self.root+"/a.zip",self.root+"/c.zip"])
+
+    def testChangedArchiveReopened(self):
+        self.pool.get(self.root+"/a.zip")
+        zf = zipfile.ZipFile(self.root+"/a.zip","a")
+        zf.writestr("new.txt","new")
+        zf.close()
+        f = self.pool.open_member(self.root+"/a.zip","new.txt")
+        self.assertEqual(f.read(),"new")
+        self.assertEqual(self.pool.opens,2)
+
+class TestPack(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp().replace("\\","/")
+        os.makedirs(self.root+"/art/port")
+        pack = assetpack.PackWriter(self.root+"/art/port/maya.pwpack")
+        pack.add_pixels("normal(blink).png","\x01\x02\x03\x04"*6,(3,2),"RGBA",{"horizontal":3})
+        pack.add_file("sub/notes.txt","notes")
+        pack.add_page("RGBA0","\xff"*4*8,(4,2),"RGBA")
+        pack.add_frame("angry(talk).png","RGBA0",[2,0,2,2],{"horizontal":2})
+        pack.close()
+        registry.global_registry_cache.clear()
+
+    def tearDown(self):
+        registry.global_registry_cache.clear()
+        assetpack.close_all()
+        shutil.rmtree(self.root)
+
+    def testMounted(self):
+        """A pack is indexed like the folder it was built from."""
+        reg = registry.Registry(self.root)
+        path = reg.lookup("art/port/maya/normal(blink)")
+        self.assertEqual(path,self.root+"/art/port/maya.pwpack/normal(blink).png")
+        self.assertEqual(reg.lookup("art/port/maya/sub/notes.txt",True),self.root+"/art/port/maya.pwpack/sub/notes.txt")
+        self.assertEqual(reg.open(self.root+"/art/port/maya.pwpack/sub/notes.txt").read(),"notes")
+
+    def testPixels(self):
+        reg = registry.Registry(self.root)
+        record,data = reg.packed(reg.lookup("art/port/maya/normal(blink)"))
+        self.assertEqual((record["width"],record["height"],record["format"]),(3,2,"RGBA"))
+        self.assertEqual(record["meta"],{"horizontal":3})
+        self.assertEqual(str(data),"\x01\x02\x03\x04"*6)
+        self.assertEqual(reg.packed(self.root+"/art/port/maya.pwpack/sub/notes.txt"),None)
+
+    def testAtlasFrame(self):
+        """Atlas frames resolve to their page and rect."""
+        reg = registry.Registry(self.root)
+        record,data = reg.packed(reg.lookup("art/port/maya/angry(talk)"))
+        self.assertEqual((record["page"],record["rect"],record["page_size"]),("RGBA0",[2,0,2,2],(4,2)))
+        self.assertEqual(len(data),32)
+        pack = assetpack.get(self.root+"/art/port/maya.pwpack")
+        self.assertEqual(pack.open("angry(talk).png").read(),"\xff"*4*4)
+
+    def testShelfPack(self):
+        sizes = [(600,100),(600,300),(300,200),(1024,900)]
+        places = assetpack.shelf_pack(sizes,(1024,1024))
+        self.assertEqual(places,[[1,0,300],[1,0,0],[1,600,0],[0,0,0]])
+        for i,(page,x,y) in enumerate(places):
+            w,h = sizes[i]
+            self.assertTrue(x+w<=1024 and y+h<=1024)
+            for j,(page2,x2,y2) in enumerate(places[:i]):
+                w2,h2 = sizes[j]
+                if page==page2:
+                    self.assertFalse(x<x2+w2 and x2<x+w and y<y2+h2 and y2<y+h)
+        self.assertEqual(len(set([p[0] for p in places])),2)
+
+    def testBadPack(self):
+        f = open(self.root+"/art/bad.pwpack","wb")
+        f.write("junk"*10)
+        f.close()
+        self.assertRaises(assetpack.PackError,assetpack.Pack,self.root+"/art/bad.pwpack")
+        self.assertFalse(assetpack.is_pack(self.root+"/art/bad.pwpack"))
+        registry.Registry(self.root)
+        #Packs written before the index was marshalled are not mounted
+        f = open(self.root+"/art/bad.pwpack","wb")
+        f.write(assetpack.header.pack(assetpack.magic,2,assetpack.header.size)+"junk")
+        f.close()
+        self.assertFalse(assetpack.is_pack(self.root+"/art/bad.pwpack"))
+        f = open(self.root+"/art/bad.pwpack","wb")
+        f.write(assetpack.header.pack(assetpack.magic,assetpack.version,assetpack.header.size)+"junk")
+        f.close()
+        self.assertRaises(assetpack.PackError,assetpack.Pack,self.root+"/art/bad.pwpack")
+
+if __name__ == "__main__":
+    unittest.main()
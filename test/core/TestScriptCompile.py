@@ -0,0 +1,128 @@
+'''
+Tests compiled script commands against cleaning and splitting lines as they run.
+'''
+import unittest
+import os
+import random
+
+from core import scriptcompile
+
+def old_getline(line):
+    line = line.replace("\t","    ")
+    line = line.replace("\r","").replace("\n","")
+    line = line.rsplit("#",1)[0]
+    line = line.rsplit("//",1)[0]
+    return line.strip()
+
+def old_args(line,variables):
+    """What execute_line passed to call_func for a cleaned line"""
+    if line[0] in [u'"',u'\u201C'] and len(line)>1:
+        if not (line.endswith('"') or line.endswith(u'\u201C')):
+            line = line+u'"'
+        return ["textbox",line[1:-1]]
+    def repvar(x):
+        if x.startswith("$") and not x[1].isdigit():
+            return variables[x[1:]]
+        elif x.startswith("$"):
+            return u""
+        if u"=" in x:
+            spl = x.split(u"=",1)
+            if spl[1].startswith(u"$"):
+                return spl[0]+u"="+variables[spl[1][1:]]
+        return x
+    return [repvar(x) for x in line.split(u" ")]
+
+def old_goto(labels,name,si,backup="none"):
+    """goto_result's scan of the labels, returning (label,line) or None"""
+    first = None
+    for label,index in labels:
+        if first is None and label==name:
+            first = index
+        if label == name and index>=si:
+            return label,index
+        if label == backup and index>si:
+            return backup,index
+    if first is not None:
+        return name,first
+
+class Anything(dict):
+    def __getitem__(self,key):
+        return u"<%s>"%key
+
+class Script(object):
+    def _print(self,*args):
+        return args
+    def __repr__(self):
+        return "script"
+    name = "not a command"
+
+class Test(unittest.TestCase):
+
+    def testCommand(self):
+        c = scriptcompile.compile_line(u"\tchar $who e=$emo x=10 $1 #comment")
+        self.assertEqual(c.text,u"char $who e=$emo x=10 $1")
+        self.assertFalse(c.textbox)
+        self.assertEqual(c.opcode,u"char")
+        self.assertEqual(c.resolve({"who":u"maya","emo":u"sad"}),[u"char",u"maya",u"e=sad",u"x=10",u""])
+        self.assertRaises(KeyError,c.resolve,{})
+        c = scriptcompile.compile_line(u'"Hello // there')
+        self.assertTrue(c.textbox)
+        self.assertEqual(c.args,["textbox",u"Hello"])
+        self.assertEqual(scriptcompile.compile_line(u"$cmd 1").opcode,None)
+        self.assertEqual(scriptcompile.compile_line(u"  // nothing").text,u"")
+
+    def testLikeBefore(self):
+        """Every line of the bundled scripts cleans and splits as it did"""
+        count = 0
+        for folder in ["examples","games"]:
+            for root,dirs,files in os.walk(folder):
+                for f in files:
+                    if not f.endswith(".txt"):
+                        continue
+                    text = open(root+"/"+f,"rU").read().decode("utf8","ignore")
+                    for line in text.split("\n"):
+                        c = scriptcompile.compile_line(line)
+                        self.assertEqual(c.text,old_getline(line))
+                        if c.text and c.text!="$":
+                            self.assertEqual(c.resolve(Anything()),old_args(c.text,Anything()),line)
+                        count += 1
+        self.assertTrue(count>1000)
+
+    def testCache(self):
+        lines = [u"print a",u"goto b"]
+        a = scriptcompile.compile_script("game/scene.txt",lines)
+        self.assertTrue(scriptcompile.compile_script("game/scene.txt",lines[:]) is a)
+        b = scriptcompile.compile_script("game/scene.txt",lines+[u"print c"])
+        self.assertFalse(b is a)
+        self.assertEqual(len(b),3)
+
+    def testTable(self):
+        table = scriptcompile.command_table(Script)
+        self.assertEqual(table.keys(),["print"])
+        self.assertEqual(table["print"](Script(),"print","x"),("print","x"))
+
+    def testFindLabel(self):
+        labels = [["top",0],["a",3],["none",5],["b",5],["a",9],["none",12]]
+        index = scriptcompile.label_index(labels)
+        self.assertEqual(scriptcompile.find_label(index,"a",4),("none",5))
+        self.assertEqual(scriptcompile.find_label(index,"a",4,"x"),("a",9))
+        self.assertEqual(scriptcompile.find_label(index,"a",10,"x"),("a",3))
+        self.assertEqual(scriptcompile.find_label(index,"missing",20),None)
+
+    def testFindLikeBefore(self):
+        r = random.Random(1)
+        names = ["none","a","b","c","d"]
+        for n in range(200):
+            labels = []
+            for line in range(60):
+                while r.random()<0.3:
+                    labels.append([r.choice(names),line])
+            index = scriptcompile.label_index(labels)
+            for si in range(-1,62):
+                for name in names:
+                    for backup in ["none","c"]:
+                        self.assertEqual(scriptcompile.find_label(index,name,si,backup),
+                            old_goto(labels,name,si,backup))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,250 @@
+'''
+Tests compiled expressions and conditions against the evaluator they replaced.
+'''
+import unittest
+import random
+
+from core import scriptexpr
+
+variables = {}
+
+def vtrue(variable):
+    if variable.lower() in ["on","1","true"]:
+        return True
+    return False
+
+def INT(n):
+    try:
+        return int(n)
+    except:
+        return float(n)
+def EVAL(stuff):
+    stuff = stuff.split(" ",2)
+    if len(stuff)==1:
+        return vtrue(variables.get(stuff[0],""))
+    if len(stuff)==2:
+        stuff = stuff[0],"=",stuff[1]
+    current,op,check = stuff
+    if op not in ["<",">","=","!=","<=",">="]:
+        check = op+" "+check
+        op = "="
+    current = variables.get(current)
+    if op=="=":op="=="
+    if op not in ["==","!="]:
+        current = INT(current)
+        check = INT(check)
+    if op == ">":
+        return current > check
+    elif op == "<":
+        return current < check
+    elif op == "==":
+        return current == check
+    elif op == "!=":
+        return current != check
+    elif op == "<=":
+        return current <= check
+    elif op == ">=":
+        return current >= check
+def GV(v):
+    if v[0].isdigit():
+        if "." in v:
+            return float(v)
+        return int(v)
+    if v.startswith("'") and v.endswith("'"):
+        return v[1:-1]
+    v = variables.get(v,"")
+    if v[0].isdigit():
+        if "." in v:
+            return float(v)
+        return int(v)
+    return v
+def ADD(statements):
+    return GV(statements[0])+GV(statements[1])
+def MUL(statements):
+    return GV(statements[0])*GV(statements[1])
+def MINUS(statements):
+    return GV(statements[0])-GV(statements[1])
+def DIV(statements):
+    return GV(statements[0])/GV(statements[1])
+def EQ(statements):
+    return str(GV(statements[0])==GV(statements[1])).lower()
+def GTEQ(statements):
+    return str(GV(statements[0])>=GV(statements[1])).lower()
+def GT(statements):
+    return str(GV(statements[0])>GV(statements[1])).lower()
+def LT(statements):
+    return str(GV(statements[0])<GV(statements[1])).lower()
+def LTEQ(statements):
+    return str(GV(statements[0])<=GV(statements[1])).lower()
+def AND(statements):
+    if vtrue(statements[0]) and vtrue(statements[1]):
+        return "true"
+    return "false"
+def OR(stuff):
+    for line in stuff:
+        if EVAL(line):
+            return True
+    return False
+def OR2(statements):
+    if vtrue(statements[0]) or vtrue(statements[1]):
+        return "true"
+    return "false"
+def EXPR(line):
+    statements = []
+    cur = ""
+    paren = []
+    quote = []
+    for word in line.split(" "):
+        if not paren and not quote and word == "+":
+            statements.append(ADD)
+        elif not paren and not quote and word == "*":
+            statements.append(MUL)
+        elif not paren and not quote and word == "-":
+            statements.append(MINUS)
+        elif not paren and not quote and word == "/":
+            statements.append(DIV)
+        elif not paren and not quote and word == "==":
+            statements.append(EQ)
+        elif not paren and not quote and word == "<=":
+            statements.append(LTEQ)
+        elif not paren and not quote and word == ">=":
+            statements.append(GTEQ)
+        elif not paren and not quote and word == "<":
+            statements.append(LT)
+        elif not paren and not quote and word == ">":
+            statements.append(GT)
+        elif not paren and not quote and word == "AND":
+            statements.append(AND)
+        elif not paren and not quote and word == "OR":
+            statements.append(OR2)
+        elif word.strip():
+            if paren:
+                if word.endswith(")"):
+                    paren.append(word)
+                    statements.append(EXPR(" ".join(paren)[1:-1]))
+                    paren = []
+                else:
+                    paren.append(word)
+            elif quote:
+                quote.append(word)
+                if word.endswith("'"):
+                    statements.append(" ".join(quote))
+                    quote = []
+            elif word.startswith("(") and word.endswith(")"):
+                statements.append(word[1:-1])
+            elif word.startswith("("):
+                paren.append(word)
+            elif word.startswith("'") and word.endswith("'"):
+                statements.append(word)
+            elif word.startswith("'"):
+                quote.append(word)
+            else:
+                statements.append(word)
+    return statements
+def EVAL_EXPR(expr):
+    if not isinstance(expr,list):
+        return str(expr)
+    if len(expr)==1:
+        return EVAL_EXPR(expr[0])
+    oop = [MUL,DIV,ADD,MINUS,EQ,LT,GT,LTEQ,GTEQ,OR2,AND]
+    ops = []
+    for i,v in enumerate(expr):
+        if v in oop:
+            ops.append((i,v))
+    if not ops:
+        return str(expr[0])
+    ops.sort(key=lambda x: oop.index(x[1]))
+    op = ops[0]
+    left = expr[op[0]-1:op[0]]
+    right = expr[op[0]+1:op[0]+2]
+    left = EVAL_EXPR(left)
+    right = EVAL_EXPR(right)
+    v = op[1]([left,right])
+    expr[op[0]-1] = v
+    del expr[op[0]]
+    del expr[op[0]]
+    return EVAL_EXPR(expr)
+
+def old_is(text):
+    args = text.split(" AND ")
+    args = [x.split(" OR ") for x in args]
+    args = [OR(x) for x in args]
+    return False not in args
+
+def old(f,*args):
+    """Result of f, or Exception if it failed. Parts are worked out in a
+    different order now, so which error comes first can differ."""
+    try:
+        return f(*args)
+    except Exception,e:
+        return Exception
+
+def random_expression(r,depth=0):
+    operands = ["5","12","0","3.5","x","y","name","empty","'funny'","'not funny'","'a b'"]
+    words = []
+    for i in range(r.randint(1,4)):
+        if words:
+            words.append(r.choice(["+","-","*","/","==","<",">","<=",">=","AND","OR","="]))
+        if depth<1 and r.random()<0.2:
+            words.append("("+random_expression(r,depth+1)+")")
+        else:
+            words.append(r.choice(operands))
+    return " ".join(words)
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        variables.clear()
+        variables.update({"x":"4","y":"2.5","name":"phoenix","flag":"true","off":"false"})
+
+    def evaluate(self,line):
+        return scriptexpr.compile_expression(line)(variables)
+
+    def testAsserts(self):
+        self.assertEqual(self.evaluate("5 + 1 + 3 * 10"),"36")
+        self.assertEqual(self.evaluate("2 * (5 + 1)"),"12")
+        self.assertEqual(self.evaluate("'funny ' + 'business'"),"funny business")
+        self.assertEqual(self.evaluate("2 * (5 + 1) == (5 + 1) * 2"),"true")
+        self.assertEqual(self.evaluate("5 + x + 3 * 10"),"39")
+        self.assertEqual(self.evaluate("(5 == 4 OR 5 == 5) AND (1 + 3 == 4) AND ('funny' = 'not funny')"),"false")
+        self.assertEqual(self.evaluate("(5 == 4 OR 5 == 5) AND (1 + 3 == 4) OR ('funny' = 'not funny')"),"true")
+        self.assertEqual(self.evaluate("5 >= 5"),"true")
+        self.assertEqual(self.evaluate("5 <= 3"),"false")
+
+    def testExpressionsLikeBefore(self):
+        r = random.Random(2)
+        for n in range(3000):
+            line = random_expression(r)
+            expected = old(lambda:EVAL_EXPR(EXPR(line)))
+            if "<function" in str(expected):
+                #A parenthesized part followed by no operator prints its tokens
+                continue
+            got = old(self.evaluate,line)
+            self.assertEqual(got,expected,line)
+            #Compiled once, still follows the variables
+            variables["x"] = str(n)
+            self.assertEqual(old(self.evaluate,line),old(lambda:EVAL_EXPR(EXPR(line))),line)
+            variables["x"] = "4"
+
+    def testConditionsLikeBefore(self):
+        conditions = ["flag","off","missing","x 4","x = 4","x != 4","x > 3","x <= 3","y >= 2.5",
+            "name phoenix","name = maya","x < abc","name > 3"]
+        r = random.Random(3)
+        for n in range(2000):
+            words = [r.choice(conditions)]
+            for i in range(r.randint(0,3)):
+                words.append(r.choice(["AND","OR"]))
+                words.append(r.choice(conditions))
+            text = " ".join(words)
+            self.assertEqual(old(scriptexpr.check_conditions,text,variables),old(old_is,text),text)
+
+    def testFlags(self):
+        self.assertTrue(scriptexpr.check_flags(["flag"],variables))
+        self.assertFalse(scriptexpr.check_flags(["flag","AND","missing"],variables))
+        self.assertTrue(scriptexpr.check_flags(["missing","AND","flag","OR","x"],variables))
+        self.assertFalse(scriptexpr.check_flags(["missing","OR","flag","AND","other"],variables))
+        self.assertRaises(ValueError,scriptexpr.check_flags,["flag","XOR","x"],variables)
+        self.assertRaises(ValueError,scriptexpr.check_flags,["flag","AND"],variables)
+
+if __name__ == "__main__":
+    unittest.main()
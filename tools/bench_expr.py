@@ -0,0 +1,204 @@
+"""Expression benchmark, run from the PyWright folder:
+
+    python tools/bench_expr.py
+
+Evaluates the kinds of expressions is_ex, set_ex and is use, with the old
+evaluator which tokenized and reduced the expression every time, and with
+the compiled expressions and conditions from core/scriptexpr."""
+import sys,time
+sys.path.insert(0,".")
+from core import scriptexpr
+
+variables = {"score":"12","lives":"3","name":"phoenix","talked_maya":"true","x":"7.5"}
+
+def vtrue(variable):
+    if variable.lower() in ["on","1","true"]:
+        return True
+    return False
+
+#Evaluator from core/libengine before core/scriptexpr
+def INT(n):
+    try:
+        return int(n)
+    except:
+        return float(n)
+def EVAL(stuff):
+    stuff = stuff.split(" ",2)
+    if len(stuff)==1:
+        return vtrue(variables.get(stuff[0],""))
+    if len(stuff)==2:
+        stuff = stuff[0],"=",stuff[1]
+    current,op,check = stuff
+    if op not in ["<",">","=","!=","<=",">="]:
+        check = op+" "+check
+        op = "="
+    current = variables.get(current)
+    if op=="=":op="=="
+    if op not in ["==","!="]:
+        current = INT(current)
+        check = INT(check)
+    if op == ">":
+        return current > check
+    elif op == "<":
+        return current < check
+    elif op == "==":
+        return current == check
+    elif op == "!=":
+        return current != check
+    elif op == "<=":
+        return current <= check
+    elif op == ">=":
+        return current >= check
+def GV(v):
+    if v[0].isdigit():
+        if "." in v:
+            return float(v)
+        return int(v)
+    if v.startswith("'") and v.endswith("'"):
+        return v[1:-1]
+    v = variables.get(v,"")
+    if v[0].isdigit():
+        if "." in v:
+            return float(v)
+        return int(v)
+    return v
+def ADD(statements):
+    return GV(statements[0])+GV(statements[1])
+def MUL(statements):
+    return GV(statements[0])*GV(statements[1])
+def MINUS(statements):
+    return GV(statements[0])-GV(statements[1])
+def DIV(statements):
+    return GV(statements[0])/GV(statements[1])
+def EQ(statements):
+    return str(GV(statements[0])==GV(statements[1])).lower()
+def GTEQ(statements):
+    return str(GV(statements[0])>=GV(statements[1])).lower()
+def GT(statements):
+    return str(GV(statements[0])>GV(statements[1])).lower()
+def LT(statements):
+    return str(GV(statements[0])<GV(statements[1])).lower()
+def LTEQ(statements):
+    return str(GV(statements[0])<=GV(statements[1])).lower()
+def AND(statements):
+    if vtrue(statements[0]) and vtrue(statements[1]):
+        return "true"
+    return "false"
+def OR(stuff):
+    for line in stuff:
+        if EVAL(line):
+            return True
+    return False
+def OR2(statements):
+    if vtrue(statements[0]) or vtrue(statements[1]):
+        return "true"
+    return "false"
+def EXPR(line):
+    statements = []
+    cur = ""
+    paren = []
+    quote = []
+    for word in line.split(" "):
+        if not paren and not quote and word == "+":
+            statements.append(ADD)
+        elif not paren and not quote and word == "*":
+            statements.append(MUL)
+        elif not paren and not quote and word == "-":
+            statements.append(MINUS)
+        elif not paren and not quote and word == "/":
+            statements.append(DIV)
+        elif not paren and not quote and word == "==":
+            statements.append(EQ)
+        elif not paren and not quote and word == "<=":
+            statements.append(LTEQ)
+        elif not paren and not quote and word == ">=":
+            statements.append(GTEQ)
+        elif not paren and not quote and word == "<":
+            statements.append(LT)
+        elif not paren and not quote and word == ">":
+            statements.append(GT)
+        elif not paren and not quote and word == "AND":
+            statements.append(AND)
+        elif not paren and not quote and word == "OR":
+            statements.append(OR2)
+        elif word.strip():
+            if paren:
+                if word.endswith(")"):
+                    paren.append(word)
+                    statements.append(EXPR(" ".join(paren)[1:-1]))
+                    paren = []
+                else:
+                    paren.append(word)
+            elif quote:
+                quote.append(word)
+                if word.endswith("'"):
+                    statements.append(" ".join(quote))
+                    quote = []
+            elif word.startswith("(") and word.endswith(")"):
+                statements.append(word[1:-1])
+            elif word.startswith("("):
+                paren.append(word)
+            elif word.startswith("'") and word.endswith("'"):
+                statements.append(word)
+            elif word.startswith("'"):
+                quote.append(word)
+            else:
+                statements.append(word)
+    return statements
+def EVAL_EXPR(expr):
+    if not isinstance(expr,list):
+        return str(expr)
+    if len(expr)==1:
+        return EVAL_EXPR(expr[0])
+    oop = [MUL,DIV,ADD,MINUS,EQ,LT,GT,LTEQ,GTEQ,OR2,AND]
+    ops = []
+    for i,v in enumerate(expr):
+        if v in oop:
+            ops.append((i,v))
+    if not ops:
+        return str(expr[0])
+    ops.sort(key=lambda x: oop.index(x[1]))
+    op = ops[0]
+    left = expr[op[0]-1:op[0]]
+    right = expr[op[0]+1:op[0]+2]
+    left = EVAL_EXPR(left)
+    right = EVAL_EXPR(right)
+    v = op[1]([left,right])
+    expr[op[0]-1] = v
+    del expr[op[0]]
+    del expr[op[0]]
+    return EVAL_EXPR(expr)
+
+def old_is(text):
+    args = text.split(" AND ")
+    args = [x.split(" OR ") for x in args]
+    args = [OR(x) for x in args]
+    return False not in args
+
+expressions = ["score + 1","score * 2 + lives * 10 - 3","(score >= 10 AND lives > 0) OR talked_maya == 'true'",
+    "'Mr. ' + name","x * (lives + 1) <= 40"]
+conditions = ["talked_maya","score > 10 AND lives >= 1","name = phoenix OR name = maya","lives != 3"]
+
+def rate(f,items,seconds=1.0):
+    n = 0
+    start = time.time()
+    while time.time()-start<seconds:
+        for item in items:
+            f(item)
+        n += len(items)
+    return n/(time.time()-start)
+
+def run():
+    for line in expressions:
+        assert EVAL_EXPR(EXPR(line))==scriptexpr.compile_expression(line)(variables),line
+    for text in conditions:
+        assert old_is(text)==scriptexpr.check_conditions(text,variables),text
+    before = rate(lambda line:EVAL_EXPR(EXPR(line)),expressions)
+    after = rate(lambda line:scriptexpr.compile_expression(line)(variables),expressions)
+    print "expressions  old %8.0f/s  compiled %8.0f/s  (%.1fx)"%(before,after,after/before)
+    before = rate(old_is,conditions)
+    after = rate(lambda text:scriptexpr.check_conditions(text,variables),conditions)
+    print "conditions   old %8.0f/s  compiled %8.0f/s  (%.1fx)"%(before,after,after/before)
+
+if __name__=="__main__":
+    run()
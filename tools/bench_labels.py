@@ -0,0 +1,66 @@
+"""Label jump benchmark, run from the PyWright folder:
+
+    python tools/bench_labels.py
+
+Jumps around a synthetic script with 5k labels, laid out like a long cross
+examination, with goto_result's old scan of the label list and with the
+label index from core/scriptcompile."""
+import sys,time,random
+sys.path.insert(0,".")
+from core import scriptcompile
+
+def old_goto(labels,name,si,backup="none"):
+    """Label search in Script.goto_result before the label index"""
+    first = None
+    for label,index in labels:
+        if first is None and label==name:
+            first = index
+        if label == name and index>=si:
+            return label,index
+        if label == backup and index>si:
+            return backup,index
+    if first is not None:
+        return name,first
+
+def synthetic_labels(count=5000):
+    """Statements with a press label each, a present label for every tenth,
+    and a none label closing each group of 50"""
+    labels = []
+    line = 0
+    for i in range(count):
+        labels.append(["press%d"%i,line])
+        line += 4
+        if i%10==0:
+            labels.append(["present%d"%i,line])
+            line += 4
+        if i%50==49:
+            labels.append(["none",line])
+            line += 4
+    return labels,line
+
+def rate(goto,jumps,seconds=1.0):
+    n = 0
+    start = time.time()
+    while time.time()-start<seconds:
+        for name,si in jumps:
+            goto(name,si)
+        n += len(jumps)
+    return n/(time.time()-start)
+
+def run(count=5000):
+    labels,lines = synthetic_labels(count)
+    index = scriptcompile.label_index(labels)
+    r = random.Random(0)
+    jumps = [(r.choice(labels)[0],r.randrange(lines)) for i in range(200)]
+    jumps += [("present%d"%r.randrange(count),r.randrange(lines)) for i in range(50)]
+    for name,si in jumps:
+        assert old_goto(labels,name,si)==scriptcompile.find_label(index,name,si),name
+    before = rate(lambda name,si:old_goto(labels,name,si),jumps)
+    after = rate(lambda name,si:scriptcompile.find_label(index,name,si),jumps)
+    print "%d labels over %d lines"%(len(labels),lines)
+    print "scan   %9.0f jumps/s"%before
+    print "index  %9.0f jumps/s  (%.0fx)"%(after,after/before)
+    return before,after
+
+if __name__=="__main__":
+    run()
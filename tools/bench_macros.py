@@ -0,0 +1,73 @@
+"""Macro expansion benchmark, run from the PyWright folder:
+
+    python tools/bench_macros.py
+
+Expands a synthetic 20k line script, where one line in five calls a macro,
+with the old in place replace_macros and with core/macroexpand."""
+import sys,time
+sys.path.insert(0,".")
+from core import macroexpand
+
+def old_replace_macros(lines,macros):
+    """Assets.replace_macros before core/macroexpand"""
+    i = 0
+    while i<len(lines):
+        line = lines[i]
+        if line.startswith("{"):
+            del lines[i]
+            i -= 1
+            args = line[1:-1].split(" ")
+            if macros.get(args[0],None):
+                newlines = "\n".join(macros[args[0]])
+                args = args[1:]
+                kwargs = {}
+                for a in args[:]:
+                    if a.count("=")==1:
+                        args.remove(a)
+                        k,v = a.split("=",1)
+                        kwargs[k] = v
+                newlines = newlines.replace("$0",str(i))
+                for i2 in range(len(args)):
+                    newlines = newlines.replace("$%s"%(i2+1),args[i2])
+                for k in kwargs:
+                    newlines = newlines.replace("$%s"%k,kwargs[k])
+                newlines = newlines.split("\n")
+                for l in reversed(newlines):
+                    lines.insert(i+1,l)
+        i += 1
+
+macros = {"say":["char $1 e=$e","\"$2\"","{pause $0}"],
+    "pause":["set _pause_$1 true","pause 30"],
+    "shake":["shake 10 $1","sfx $2.ogg"]}
+
+def synthetic_script(length=20000):
+    lines = []
+    for i in range(length):
+        if i%10==0:
+            lines.append("{say phoenix line%d e=normal}"%i)
+        elif i%10==5:
+            lines.append("{shake %d thud}"%(i%7))
+        else:
+            lines.append("\"Some text on line %d\""%i)
+    return lines
+
+def timed(expand,lines):
+    start = time.time()
+    out = expand(lines)
+    return time.time()-start,out
+
+def run(length=20000):
+    lines = synthetic_script(length)
+    def old(lines):
+        lines = lines[:]
+        old_replace_macros(lines,macros)
+        return lines
+    told,a = timed(old,lines)
+    tnew,b = timed(lambda lines:macroexpand.expand(lines,macros),lines)
+    assert a==b
+    print "%d lines in, %d lines out"%(len(lines),len(b))
+    print "replace_macros     %7.3fs"%told
+    print "macroexpand.expand %7.3fs  (%.0fx)"%(tnew,told/tnew)
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,126 @@
+"""Registry benchmarks, run from the PyWright folder:
+
+    python tools/bench_registry.py
+
+memory - bytes used by the maps of a synthetic 50k file art tree, with the
+File records as they were (every tag stored) and as they are now.
+lookups - lookups per second on the same tree, normalizing every query as
+lookup used to and with the remembered query tags and results."""
+import sys,os,time
+sys.path.insert(0,".")
+from core import registry
+
+class OldFile:
+    """registry.File before it was made compact"""
+    def __init__(self,path):
+        self.path = path
+        self.filename = self.path.rsplit("/",1)[1]
+        self.pathtag = self.path
+        self.filetag = self.filename
+        self.ext = ""
+        if "." in self.filename:
+            self.pathtag = self.path.rsplit(".",1)[0]
+            self.filetag,self.ext = self.filename.rsplit(".",1)
+        self.priority = 12
+        if self.ext in registry.priority:
+            self.priority = registry.priority.index(self.ext)
+        self.filetag = self.filetag.lower()
+        self.pathtag = self.pathtag.lower()
+        self.pathtagext = self.pathtag+"."+self.ext
+
+def synthetic_tree(files=50000):
+    """Paths laid out like a big shared art folder, 25 files per character"""
+    paths = []
+    for i in range(files):
+        folder = "./art/port/character%d"%(i//25)
+        emo = "emotion%d"%(i%25//2)
+        if i%2:
+            paths.append(folder+"/"+emo+"(talk).png")
+        else:
+            paths.append(folder+"/"+emo+"(blink).txt")
+    return paths
+
+def sizeof(ob,seen):
+    """Size of ob and everything it refers to which hasn't been counted yet"""
+    if id(ob) in seen:
+        return 0
+    seen.add(id(ob))
+    size = sys.getsizeof(ob)
+    if isinstance(ob,dict):
+        for k,v in ob.iteritems():
+            size += sizeof(k,seen)+sizeof(v,seen)
+    if hasattr(ob,"__dict__"):
+        size += sizeof(ob.__dict__,seen)
+    for name in getattr(type(ob),"__slots__",[]):
+        size += sizeof(getattr(ob,name),seen)
+    return size
+
+def build(file_class,paths):
+    old = registry.File
+    registry.File = file_class
+    try:
+        reg = registry.Registry()
+        reg.root = "."
+        for path in paths:
+            reg.mapfile(path)
+    finally:
+        registry.File = old
+    return reg
+
+def memory(files=50000):
+    paths = synthetic_tree(files)
+    results = {}
+    for label,file_class in [("old File",OldFile),("compact File",registry.File)]:
+        registry.folders.clear()
+        reg = build(file_class,paths)
+        seen = set()
+        records = sum([sizeof(f,seen) for f in reg.ext_map.values()])
+        total = records+sizeof(reg.map,seen)+sizeof(reg.ext_map,seen)
+        results[label] = total
+        print "%-13s maps %6.1f MB  %4d bytes/file  records alone %6.1f MB"%(
+            label,total/1048576.0,total//files,records/1048576.0)
+    print "saved %.0f%%"%(100-100.0*results["compact File"]/results["old File"])
+    return results
+
+def old_lookup(reg,thingie,ext=False):
+    """Registry.lookup as it was, normalizing the query every time"""
+    thingie = os.path.normpath(thingie).replace("\\","/")
+    f = OldFile(thingie)
+    map = reg.map
+    tag = f.pathtag
+    if ext:
+        map = reg.ext_map
+        tag = f.pathtagext
+    if tag in map:
+        path = map[tag].path
+        if "./" in path:
+            path = path.split("./",1)[1]
+        return path
+
+def rate(lookup,queries,seconds=1.0):
+    n = 0
+    start = time.time()
+    while time.time()-start<seconds:
+        for q in queries:
+            lookup(q)
+        n += len(queries)
+    return n/(time.time()-start)
+
+def lookups(files=50000):
+    """Queries like the ones portrait.init makes, half of them misses"""
+    reg = build(registry.File,synthetic_tree(files))
+    queries = []
+    for c in range(0,files//25,10):
+        for mode in ["(blink)","(talk)","(combined)",""]:
+            queries.append("art/port/character%d/emotion3%s"%(c,mode))
+    for q in queries:
+        assert old_lookup(reg,q)==reg.lookup(q),q
+    before = rate(lambda q:old_lookup(reg,q),queries)
+    after = rate(reg.lookup,queries)
+    print "before %9.0f lookups/s"%before
+    print "after  %9.0f lookups/s  (%.1fx)"%(after,after/before)
+    return before,after
+
+if __name__=="__main__":
+    memory()
+    lookups()
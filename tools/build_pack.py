@@ -0,0 +1,113 @@
+"""Build an asset pack from a folder of art. Run from the PyWright folder:
+
+    python tools/build_pack.py [--atlas] games/mygame/art/port/maya
+
+writes games/mygame/art/port/maya.pwpack, which the registry mounts in place
+of the folder. Images are stored as raw pixels along with the metadata from
+their .txt files, other files are stored unchanged. With --atlas the images
+are packed together onto shared pages, which suits a character's animations
+or a game's art/ev icons."""
+import os,sys
+import pygame
+from core.core import meta
+from core import assetpack
+
+image_exts = ["png","jpg","gif","bmp"]
+
+def image_meta(path):
+    txt = path.rsplit(".",1)[0]+".txt"
+    if os.path.exists(txt):
+        return meta().load_from(open(txt,"rb")).__dict__
+
+def with_alpha(surf):
+    """surf with per-pixel alpha in place of a colorkey, which is how palette
+    images with a transparent color load, so the keyed pixels stay transparent.
+    Blitted rather than converted, as convert_alpha needs a display."""
+    if surf.get_colorkey() is None or surf.get_flags()&pygame.SRCALPHA:
+        return surf
+    rgba = pygame.Surface(surf.get_size(),pygame.SRCALPHA,32)
+    rgba.fill([0,0,0,0])
+    rgba.blit(surf,[0,0])
+    return rgba
+
+def format_of(surf):
+    if surf.get_flags()&pygame.SRCALPHA:
+        return "RGBA"
+    return "RGBX"
+
+def add_image(pack,name,surf,m=None):
+    surf = with_alpha(surf)
+    format = format_of(surf)
+    pack.add_pixels(name,pygame.image.tostring(surf,format),surf.get_size(),format,m)
+
+def add_atlas(pack,images,page_size=(1024,1024)):
+    """Pack [(name,surface,meta)] onto pages, one set of pages per pixel format"""
+    images = [(name,with_alpha(surf),m) for name,surf,m in images]
+    for format in ["RGBA","RGBX"]:
+        group = [i for i in images if format_of(i[1])==format]
+        if not group:
+            continue
+        sizes = [surf.get_size() for name,surf,m in group]
+        size = (max([page_size[0]]+[w for w,h in sizes]),max([page_size[1]]+[h for w,h in sizes]))
+        places = assetpack.shelf_pack(sizes,size)
+        for p in range(max([pl[0] for pl in places])+1):
+            on_page = [(i,pl) for i,pl in enumerate(places) if pl[0]==p]
+            w = max([pl[1]+sizes[i][0] for i,pl in on_page])
+            h = max([pl[2]+sizes[i][1] for i,pl in on_page])
+            flags = 0
+            if format=="RGBA":
+                flags = pygame.SRCALPHA
+            page = pygame.Surface([w,h],flags,32)
+            for i,pl in on_page:
+                surf = group[i][1]
+                #Copy the pixels as they are rather than blending or keying them
+                surf.set_colorkey(None)
+                surf.set_alpha(None)
+                page.blit(surf,pl[1:])
+            page_name = "%s%s"%(format,p)
+            pack.add_page(page_name,pygame.image.tostring(page,format),(w,h),format)
+            for i,pl in on_page:
+                name,surf,m = group[i]
+                pack.add_frame(name,page_name,pl[1:]+list(sizes[i]),m)
+                print name,"->",page_name
+
+def build(folder,out=None,atlas=False):
+    folder = folder.replace("\\","/").rstrip("/")
+    if not out:
+        out = folder+assetpack.ext
+    files = []
+    for root,dirs,names in os.walk(folder):
+        if ".hg" in dirs:
+            dirs.remove(".hg")
+        for name in names:
+            files.append((root.replace("\\","/")+"/"+name)[len(folder)+1:])
+    images = set([f.rsplit(".",1)[0] for f in files if f.rsplit(".",1)[-1].lower() in image_exts])
+    pack = assetpack.PackWriter(out)
+    atlas_images = []
+    for name in sorted(files):
+        path = folder+"/"+name
+        base,ext = (name.rsplit(".",1)+[""])[:2]
+        if ext.lower() in image_exts:
+            surf = pygame.image.load(path)
+            if atlas:
+                atlas_images.append((name,surf,image_meta(path)))
+                continue
+            add_image(pack,name,surf,image_meta(path))
+        elif ext.lower()=="txt" and base in images:
+            continue
+        else:
+            f = open(path,"rb")
+            pack.add_file(name,f.read())
+            f.close()
+        print name
+    if atlas_images:
+        add_atlas(pack,atlas_images)
+    pack.close()
+    return out
+
+if __name__=="__main__":
+    args = [a for a in sys.argv[1:] if a!="--atlas"]
+    if not args:
+        print __doc__
+        sys.exit(1)
+    print "wrote",build(*args[:2],**{"atlas":"--atlas" in sys.argv})